@@ -0,0 +1,122 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Pool of bound LDAP connections."""
+
+from contextlib import contextmanager
+import ldap
+import logging
+import threading
+import time
+
+from client import settings, secret
+
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection can not be used anymore.
+_CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+
+class LDAPConnectionPool(object):
+    """Process-wide pool of TLS established connections bound as admin.
+
+    At most LDAP_POOL_SIZE connections are open at once. Connections idle
+    for more than LDAP_POOL_CHECK_INTERVAL seconds are checked before being
+    handed out and replaced when the server dropped them.
+    """
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self, size=None):
+        self.size = size or settings.LDAP_POOL_SIZE
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.size)
+
+    @staticmethod
+    def get():
+        with LDAPConnectionPool._instanceLock:
+            if LDAPConnectionPool._instance is None:
+                LDAPConnectionPool._instance = LDAPConnectionPool()
+            return LDAPConnectionPool._instance
+
+    def _connect(self):
+        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
+        ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
+        l = ldap.initialize(secret.LDAP_URI)
+        l.protocol_version = ldap.VERSION3
+        l.set_option(ldap.OPT_NETWORK_TIMEOUT, settings.LDAP_TIMEOUT)
+        l.timeout = settings.LDAP_TIMEOUT
+        l.start_tls_s()
+        l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
+        return l
+
+    def _close(self, l):
+        try:
+            l.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _isAlive(self, l):
+        try:
+            l.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                l, lastUsed = self.idle.pop()
+            if time.time() - lastUsed < settings.LDAP_POOL_CHECK_INTERVAL \
+                    or self._isAlive(l):
+                return l
+            logger.info('Dropping stale LDAP connection')
+            self._close(l)
+        return self._connect()
+
+    def _checkin(self, l):
+        with self.lock:
+            self.idle.append((l, time.time()))
+
+    @contextmanager
+    def connection(self):
+        """Lend a bound connection for the duration of a with block.
+
+        The connection is given back to the pool afterwards, unless it
+        failed with a connection error.
+        """
+        with self.slots:
+            l = self._checkout()
+            try:
+                yield l
+            except _CONNECTION_ERRORS:
+                self._close(l)
+                raise
+            except:
+                self._checkin(l)
+                raise
+            else:
+                self._checkin(l)
+
+    def close(self):
+        """Close every idle connection."""
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for l, lastUsed in idle:
+            self._close(l)
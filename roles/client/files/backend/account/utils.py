@@ -21,7 +21,8 @@ import ldap
 import ldap.modlist as modlist
 import random
 
-from client import settings, secret
+from client import settings
+from ldappool import LDAPConnectionPool
 
 
 def _assertUserDict(user):
@@ -79,17 +80,10 @@ def createUser(user):
     """
     _assertUserDict(user)
 
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-    ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-    l = ldap.initialize(secret.LDAP_URI)
-    l.protocol_version = ldap.VERSION3
-    l.start_tls_s()
-    l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
-
     dn = settings.LDAP_USER_DN_TEMPLATE % user['uid']
     ldif = modlist.addModlist(user)
-    l.add_s(dn, ldif)
-    l.unbind_s()
+    with LDAPConnectionPool.get().connection() as l:
+        l.add_s(dn, ldif)
 
 
 def changePassword(dn, oldHash, newHash):
@@ -100,16 +94,10 @@ def changePassword(dn, oldHash, newHash):
         oldHash (str): Old password hash.
         newHash (str): New password hash.
     """
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-    ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-    l = ldap.initialize(secret.LDAP_URI)
-    l.protocol_version = ldap.VERSION3
-    l.start_tls_s()
-    l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
     ldif = modlist.modifyModlist({'userPassword': oldHash},
                                  {'userPassword': newHash})
-    l.modify_s(dn, ldif)
-    l.unbind_s
+    with LDAPConnectionPool.get().connection() as l:
+        l.modify_s(dn, ldif)
 
 
 def isUserStaff(username):
@@ -121,13 +109,8 @@ def isUserStaff(username):
     Returns:
         bool: True if the user has staff permission. False otherwise.
     """
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-    ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-    l = ldap.initialize(secret.LDAP_URI)
-    l.protocol_version = ldap.VERSION3
-    l.start_tls_s()
-    l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
     dn = settings.LDAP_GROUP_DN_TEMPLATE % 'staff'
-    result = l.search_s(dn, ldap.SCOPE_SUBTREE)
+    with LDAPConnectionPool.get().connection() as l:
+        result = l.search_s(dn, ldap.SCOPE_SUBTREE)
     userdn = (settings.LDAP_USER_DN_TEMPLATE % username).lower()
     return userdn in result[0][1]['member']
@@ -20,9 +20,9 @@ from django.core import urlresolvers
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import ensure_csrf_cookie
 import ldap.modlist as modlist
-import ldap
 
-from client import settings, secret
+from client import settings
+from ldappool import LDAPConnectionPool
 import utils
 
 
@@ -77,13 +77,6 @@ def signup(request):
 
         # TODO: Check password and confirmation.
 
-        ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-        ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-        l = ldap.initialize(secret.LDAP_URI)
-        l.protocol_version = ldap.VERSION3
-        l.start_tls_s()
-        l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
-
         dn = settings.LDAP_USER_DN_TEMPLATE % str(username)
         user = {
             'cn': str(first_name),
@@ -94,8 +87,8 @@ def signup(request):
         }
 
         ldif = modlist.addModlist(user)
-        l.add_s(dn, ldif)
-        l.unbind_s()
+        with LDAPConnectionPool.get().connection() as l:
+            l.add_s(dn, ldif)
         context = {'username': username}
         return render(request, 'account/signup_successful.html', context)
 
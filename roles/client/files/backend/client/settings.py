@@ -24,6 +24,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
+import base64
+import hashlib
 import os
 import ldap
 import secret
@@ -191,6 +193,12 @@ AUTH_LDAP_GROUP_SEARCH = LDAPSearch(
 AUTH_LDAP_GROUP_TYPE = GroupOfNamesType(name_attr='cn')
 LDAP_USER_DN_TEMPLATE = 'uid=%s,ou=Users,' + LDAP_ROOT_DN
 LDAP_GROUP_DN_TEMPLATE = 'cn=%s,ou=Groups,' + LDAP_ROOT_DN
+# Bound connections kept by each process, timeout in seconds of the LDAP
+# operations and seconds after which an idle connection is checked before
+# being reused.
+LDAP_POOL_SIZE = 4
+LDAP_TIMEOUT = 10
+LDAP_POOL_CHECK_INTERVAL = 60
 
 
 # Gearman options
@@ -198,6 +206,100 @@ GEARMAN_HOST = '192.168.122.231'
 GEARMAN_PORT = 4730
 GEARMAN_SSH_PORT = '2200'
 GEARMAN_SSH_USER = 'client'
+# Seconds to wait for the Gearman server and seconds after which an idle
+# connection to it is checked before being used.
+GEARMAN_TIMEOUT = 10
+GEARMAN_CHECK_INTERVAL = 60
+# Seconds during which the workers and functions reported by the Gearman
+# server are reused.
+GEARMAN_REGISTRY_TTL = 10
+# Whether builds of projects running on any node are sent to the node label
+# with the shortest queue instead of to the first worker available.
+GEARMAN_LABEL_ROUTING = False
+# Seconds between two checks of the nodes to whitelist at the Gearman
+# server firewall, and seconds after which the whitelist is applied again
+# even if unchanged.
+FIREWALL_SYNC_INTERVAL = 5
+FIREWALL_RECONCILE_INTERVAL = 10 * 60
+# Seconds the nodes whitelist served to the Gearman host is cached.
+WHITELIST_CACHE_TTL = 60
+
+
+# Partner nodes options
+# Maximum amount of nodes queried at once and seconds to wait for a node.
+NODE_POOL_SIZE = 16
+NODE_TIMEOUT = 10
+# Seconds between two availability probes of an online node. Offline nodes
+# are probed with exponential backoff up to NODE_HEALTH_MAX_BACKOFF seconds.
+# Delays vary randomly by NODE_HEALTH_JITTER (a fraction of the delay).
+NODE_HEALTH_INTERVAL = 30
+NODE_HEALTH_MAX_BACKOFF = 600
+NODE_HEALTH_JITTER = 0.2
+# Seconds to wait for the nodes to answer an availability probe. Probes
+# connect and ask the node version, each waiting up to NODE_TIMEOUT.
+NODE_PROBE_TIMEOUT = 30
+# Seconds a partner Jenkins credential lease is valid for. Leases are only
+# handed out while they have more than JENKINS_LEASE_GRACE seconds left,
+# which must be longer than any operation on a node. Node passes hold one
+# lease throughout, so the grace exceeds BUILD_POLL_TIMEOUT and
+# PROJECT_SYNC_TIMEOUT. Leases are renewed once they have less than twice
+# the grace left, so keep the TTL well above that.
+JENKINS_LEASE_TTL = 40 * 60
+JENKINS_LEASE_GRACE = 10 * 60
+# Fernet key encrypting the leases passwords stored in the database.
+JENKINS_LEASE_KEY = base64.urlsafe_b64encode(
+    hashlib.sha256('jenkins-lease:' + SECRET_KEY).digest())
+
+
+# Build history options
+# Seconds between two polls of the partner nodes for new builds.
+BUILD_POLL_INTERVAL = 30
+# Whether builds are submitted as foreground Gearman jobs so that they are
+# recorded as they start and finish. Requested builds are then submitted by
+# the trackbuilds command, which checks for them every
+# BUILD_REQUEST_INTERVAL seconds. Otherwise they are submitted in
+# background from the web and recorded by the build poller only.
+BUILD_TRACKING = True
+BUILD_REQUEST_INTERVAL = 1
+# Seconds to wait for a node to report its new builds during a poll.
+BUILD_POLL_TIMEOUT = 300
+# Maximum amount of builds, newest first, fetched per job from each node.
+BUILD_HISTORY_DEPTH = 100
+# Amount of builds per page of a project build history.
+BUILD_HISTORY_PAGE_SIZE = 20
+# Maximum amount of console output bytes served per request.
+CONSOLE_OUTPUT_PAGE_SIZE = 64 * 1024
+# Seconds between two reads of a running build console output, and
+# maximum duration of a console stream. Reads are cut short at the end of
+# the stream, so keep the latter below the uwsgi harakiri timeout (see
+# bootstrap.sh).
+CONSOLE_STREAM_INTERVAL = 2
+CONSOLE_STREAM_DURATION = 15
+# Console streams keep a uwsgi worker busy, so at most CONSOLE_STREAM_SLOTS
+# of them run at once, whatever the worker. Clients beyond read the console
+# output by pages. Slots are lock files in CONSOLE_STREAM_SLOTS_DIR.
+CONSOLE_STREAM_SLOTS = 2
+CONSOLE_STREAM_SLOTS_DIR = os.path.join(BASE_DIR, 'clientdb', 'streams')
+# Project status events are served by the statusevents command on
+# STATUS_EVENTS_PORT (see client_nginx.conf). Builds are checked for
+# changes every STATUS_STREAM_INTERVAL seconds, and idle streams get a
+# keepalive every STATUS_EVENTS_KEEPALIVE seconds. Without the events, the
+# projects list page polls the statuses every STATUS_POLL_INTERVAL seconds.
+STATUS_EVENTS_PORT = 8081
+STATUS_STREAM_INTERVAL = 2
+STATUS_EVENTS_KEEPALIVE = 30
+STATUS_POLL_INTERVAL = 5
+# Maximum amount of archived console output lines served per request.
+CONSOLE_OUTPUT_PAGE_LINES = 1000
+
+# Console output archive of finished builds. Logs older than the retention
+# are removed, as are the oldest logs once the archive exceeds its size.
+# The archive is pruned by the build poller every LOG_ARCHIVE_PRUNE_INTERVAL
+# seconds.
+LOG_ARCHIVE_DIR = os.path.join(BASE_DIR, 'clientdb', 'logs')
+LOG_ARCHIVE_RETENTION_DAYS = 90
+LOG_ARCHIVE_MAX_SIZE = 2 * 1024 * 1024 * 1024  # 2 GiB
+LOG_ARCHIVE_PRUNE_INTERVAL = 60 * 60  # 1 hour
 
 
 # Internationalization
@@ -214,6 +316,24 @@ USE_L10N = True
 USE_TZ = True
 
 REMOVE_DANGLING_PROJECTS = False
+# Seconds to wait for the nodes to synchronize their projects jobs.
+PROJECT_SYNC_TIMEOUT = 300
+# Seconds a project change waits in the sync outbox, so that further
+# changes to the project merge into it.
+PROJECT_SYNC_WINDOW = 10
+# Seconds between two checks of the sync outbox and maximum amount of
+# requests applied at once.
+PROJECT_SYNC_INTERVAL = 5
+PROJECT_SYNC_BATCH_SIZE = 100
+# Seconds before retrying a failed sync, doubled on each failure up to
+# PROJECT_SYNC_MAX_BACKOFF.
+PROJECT_SYNC_RETRY_DELAY = 30
+PROJECT_SYNC_MAX_BACKOFF = 30 * 60
+# Seconds between two synchronizations of every project with every node.
+PROJECT_RECONCILE_INTERVAL = 10 * 60
+# Seconds during which the job of a deleted project is removed from the
+# nodes coming back online.
+PROJECT_TOMBSTONE_TTL = 30 * 24 * 60 * 60
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
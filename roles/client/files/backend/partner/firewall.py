@@ -0,0 +1,132 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Whitelisting of the partner nodes at the Gearman server firewall.
+
+The Gearman host accepts the addresses in the IPSET ip set with a single
+iptables rule (see the gearmand role iptables_setup.sh). The set is
+replaced as a whole: a new set is filled and swapped with the current one
+by a single "ipset restore", so the firewall never sees a partial set.
+"""
+
+from paramiko.client import SSHClient
+import logging
+import paramiko
+import socket
+import time
+
+from client import settings
+import utils
+
+
+logger = logging.getLogger(__name__)
+
+IPSET = 'nodes'
+IPSET_COMMAND = 'sudo /sbin/ipset restore'
+
+
+class GearmanFirewall(object):
+    """SSH session to the Gearman host, kept open between updates."""
+
+    def __init__(self):
+        self.client = None
+
+    def _session(self):
+        transport = self.client and self.client.get_transport()
+        if transport is None or not transport.is_active():
+            self.close()
+            self.client = SSHClient()
+            self.client.load_system_host_keys()
+            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            self.client.connect(settings.GEARMAN_HOST,
+                                int(settings.GEARMAN_SSH_PORT),
+                                settings.GEARMAN_SSH_USER,
+                                timeout=settings.GEARMAN_TIMEOUT)
+            self.client.get_transport().set_keepalive(
+                settings.GEARMAN_CHECK_INTERVAL)
+        return self.client
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def apply(self, ips):
+        """Replace the whitelisted addresses with ips.
+
+        Raises:
+            IOError: When ipset fails.
+        """
+        staging = IPSET + '-new'
+        script = ['create %s hash:ip -exist' % IPSET,
+                  'create %s hash:ip -exist' % staging,
+                  'flush %s' % staging]
+        script.extend('add %s %s' % (staging, ip) for ip in sorted(ips))
+        script.extend(['swap %s %s' % (staging, IPSET),
+                       'destroy %s' % staging])
+
+        try:
+            stdin, stdout, stderr = self._session().exec_command(
+                IPSET_COMMAND, timeout=settings.GEARMAN_TIMEOUT)
+            stdin.write('\n'.join(script) + '\n')
+            stdin.channel.shutdown_write()
+            status = stdout.channel.recv_exit_status()
+            errors = stderr.read()
+        except (paramiko.SSHException, socket.error):
+            self.close()
+            raise
+        if status != 0:
+            raise IOError('ipset restore failed: %s' % errors.strip())
+
+
+class FirewallReconciler(object):
+    """Keeps the Gearman firewall whitelist in line with the Node table.
+
+    The desired addresses are read every FIREWALL_SYNC_INTERVAL seconds
+    and applied only when they changed, so a burst of node registrations
+    results in a single update. They are applied anyway every
+    FIREWALL_RECONCILE_INTERVAL seconds, in case the Gearman host was
+    restarted or changed by hand.
+    """
+
+    def __init__(self, firewall=None):
+        self.firewall = firewall or GearmanFirewall()
+        self.applied = None
+        self.lastApplied = 0
+
+    def desired(self):
+        ips = set()
+        for host in utils.getWhitelist():
+            try:
+                ips.add(socket.gethostbyname(host))
+            except socket.error:
+                logger.warning('Failed to resolve node host %s', host)
+        return ips
+
+    def reconcile(self):
+        """Apply the whitelist when needed.
+
+        Returns:
+            bool: Whether the whitelist was applied.
+        """
+        ips = self.desired()
+        if ips == self.applied and time.time() - self.lastApplied < \
+                settings.FIREWALL_RECONCILE_INTERVAL:
+            return False
+
+        self.firewall.apply(ips)
+        logger.info('Whitelisted %d nodes at the Gearman firewall', len(ips))
+        self.applied = ips
+        self.lastApplied = time.time()
+        return True
@@ -0,0 +1,183 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Gearman server workers and functions, as told by its admin protocol."""
+
+import gear
+import threading
+import time
+
+from client import settings
+from project.utils import getGearClient
+
+
+class GearmanWorker(object):
+    """A connection to the Gearman server that registered functions."""
+
+    def __init__(self, ip, clientId, functions):
+        self.ip = ip
+        self.clientId = clientId
+        self.functions = functions
+
+
+class GearmanFunction(object):
+    """Jobs and workers of a function registered in the Gearman server."""
+
+    def __init__(self, name, queued, running, workers):
+        self.name = name
+        self.queued = queued
+        self.running = running
+        self.workers = workers
+
+
+def _responseLines(response):
+    for line in response.splitlines():
+        if line.strip() == '.':
+            break
+        if line.strip():
+            yield line
+
+
+def parseWorkers(response):
+    """Parse the response to a "workers" admin request.
+
+    Each line describes a connection as "FD IP CLIENT-ID : FUNCTION ...".
+    Connections without functions are clients and are left out.
+
+    Returns:
+        list: GearmanWorker instances.
+    """
+    workers = []
+    for line in _responseLines(response):
+        connection, _, functions = line.partition(' : ')
+        fields = connection.split()
+        functions = set(functions.split())
+        if len(fields) < 3 or not functions:
+            continue
+        workers.append(GearmanWorker(fields[1], fields[2], functions))
+    return workers
+
+
+def parseStatus(response):
+    """Parse the response to a "status" admin request.
+
+    Each line describes a function as "FUNCTION\\tTOTAL\\tRUNNING\\tWORKERS".
+
+    Returns:
+        dict: GearmanFunction instances by function name.
+    """
+    functions = {}
+    for line in _responseLines(response):
+        fields = line.split('\t')
+        if len(fields) != 4:
+            continue
+        try:
+            total, running, workers = [int(f) for f in fields[1:]]
+        except ValueError:
+            continue
+        functions[fields[0]] = GearmanFunction(fields[0], total - running,
+                                               running, workers)
+    return functions
+
+
+class GearmanState(object):
+    """Workers and functions of the Gearman server at a point in time."""
+
+    def __init__(self, workers, functions):
+        self.workers = workers
+        self.functions = functions
+        self.fetched = time.time()
+
+    def nodeIps(self):
+        return list(set(worker.ip for worker in self.workers))
+
+    def function(self, name):
+        return self.functions.get(name)
+
+    def labelLoad(self, label):
+        """Return the builds and workers of a node label.
+
+        Builds are the jobs queued or running of every build:JOB:LABEL
+        function, and workers are the connections that registered any.
+
+        Returns:
+            tuple: (amount of builds, amount of workers).
+        """
+        suffix = ':' + label
+        names = set(name for name in self.functions
+                    if name.startswith('build:') and name.endswith(suffix) and
+                    name.count(':') >= 2)
+        builds = sum(self.functions[name].queued +
+                     self.functions[name].running for name in names)
+        workers = sum(1 for worker in self.workers
+                      if worker.functions & names)
+        return builds, workers
+
+
+class GearmanRegistry(object):
+    """Process-wide cache of the Gearman server state.
+
+    The state is fetched again from the server when it is older than
+    GEARMAN_REGISTRY_TTL seconds. Callers asking meanwhile share the same
+    fetch.
+    """
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self):
+        self.state = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        with GearmanRegistry._instanceLock:
+            if GearmanRegistry._instance is None:
+                GearmanRegistry._instance = GearmanRegistry()
+            return GearmanRegistry._instance
+
+    def _fresh(self, state):
+        return state is not None and \
+            time.time() - state.fetched < settings.GEARMAN_REGISTRY_TTL
+
+    def current(self):
+        """Return the GearmanState, fetching it if it is too old.
+
+        Raises:
+            gear.NoConnectedServersError: When the server is not connected.
+            gear.TimeoutError: When the server did not answer in time.
+        """
+        state = self.state
+        if self._fresh(state):
+            return state
+        with self.lock:
+            if not self._fresh(self.state):
+                self.state = self._fetch()
+            return self.state
+
+    def _fetch(self):
+        client = getGearClient()
+        workers = client.adminRequest(gear.WorkersAdminRequest())
+        status = client.adminRequest(gear.StatusAdminRequest())
+        return GearmanState(parseWorkers(workers), parseStatus(status))
+
+    def recordQueued(self, name):
+        """Account for a job submitted to a function since the last fetch."""
+        with self.lock:
+            function = self.state and self.state.function(name)
+            if function is not None:
+                function.queued += 1
+
+    def invalidate(self):
+        self.state = None
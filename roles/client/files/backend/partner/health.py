@@ -0,0 +1,82 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Partner nodes availability, probed in background.
+
+A single process (the probenodes management command) probes the nodes and
+records their availability in the NodeHealth table, which every other
+process reads.
+"""
+
+from django.utils import timezone
+import datetime
+import logging
+import random
+
+from client import settings
+import models
+import utils
+
+
+logger = logging.getLogger(__name__)
+
+
+class NodeHealthProber(object):
+    """Probes nodes when due and records their health.
+
+    Online nodes are probed every NODE_HEALTH_INTERVAL seconds. Offline
+    nodes are probed with exponential backoff up to NODE_HEALTH_MAX_BACKOFF
+    seconds. Every delay is jittered so probes do not synchronize.
+    """
+
+    def probe(self):
+        now = timezone.now()
+        nodes = models.Node.objects.filter(site__active=True) \
+            .select_related('site')
+        healths = dict((health.node_id, health) for health in
+                       models.NodeHealth.objects.filter(node__in=nodes))
+        due = [node for node in nodes
+               if node.id not in healths or
+               healths[node.id].nextProbe <= now]
+        if not due:
+            return
+
+        probed = dict(
+            (node.id, result) for node, result in
+            utils.mapNodes(lambda node: node.probe(), due,
+                           settings.NODE_PROBE_TIMEOUT))
+
+        for node in due:
+            status, latency = probed.get(node.id, ('offline', None))
+            health = healths.get(node.id) or models.NodeHealth(node=node)
+            self.update(health, status, latency)
+
+    def update(self, health, status, latency):
+        now = timezone.now()
+        if status != health.status or health.lastChange is None:
+            health.lastChange = now
+        health.status = status
+        if status == 'online':
+            health.failures = 0
+            health.latency = latency
+            health.lastSeen = now
+            delay = settings.NODE_HEALTH_INTERVAL
+        else:
+            health.failures += 1
+            delay = min(settings.NODE_HEALTH_INTERVAL * 2 ** health.failures,
+                        settings.NODE_HEALTH_MAX_BACKOFF)
+        jitter = settings.NODE_HEALTH_JITTER
+        health.nextProbe = now + datetime.timedelta(
+            seconds=delay * random.uniform(1 - jitter, 1 + jitter))
+        health.save()
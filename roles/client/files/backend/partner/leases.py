@@ -0,0 +1,139 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Time-boxed credentials of the partners Jenkins user accounts.
+
+A lease is a password added to the partner Jenkins LDAP account, valid for
+JENKINS_LEASE_TTL seconds and shared by every operation on the partner
+nodes, from every process. Leases are handed out only while they have
+more than JENKINS_LEASE_GRACE seconds left, so operations started with a
+lease may finish before it expires. Since the userPassword attribute is
+multi-valued, a new lease is added before the previous one is removed and
+rotations never break running operations.
+
+Leases are renewed and revoked by a single process, the rotateleases
+management command. Their passwords are stored encrypted with
+JENKINS_LEASE_KEY.
+"""
+
+from cryptography.fernet import Fernet
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+import threading
+
+from account.utils import randomPassword, hashPassword
+from client import settings
+import models
+import utils
+
+
+def encryptPassword(password):
+    return Fernet(settings.JENKINS_LEASE_KEY).encrypt(password)
+
+
+def decryptPassword(encryptedPassword):
+    return Fernet(settings.JENKINS_LEASE_KEY).decrypt(
+        str(encryptedPassword))
+
+
+class CredentialLeaseManager(object):
+    """Process-wide access point to the partners Jenkins leases."""
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self):
+        self.leases = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get():
+        with CredentialLeaseManager._instanceLock:
+            if CredentialLeaseManager._instance is None:
+                CredentialLeaseManager._instance = CredentialLeaseManager()
+            return CredentialLeaseManager._instance
+
+    def _partnerLock(self, partnerId):
+        with self.lock:
+            if partnerId not in self.locks:
+                self.locks[partnerId] = threading.Lock()
+            return self.locks[partnerId]
+
+    def _usable(self, lease, margin=None):
+        if margin is None:
+            margin = settings.JENKINS_LEASE_GRACE
+        return lease is not None and \
+            lease.expires > timezone.now() + timedelta(seconds=margin)
+
+    def acquire(self, partner):
+        """Return a JenkinsLease usable for at least JENKINS_LEASE_GRACE."""
+        with self._partnerLock(partner.id):
+            lease = self.leases.get(partner.id)
+            if not self._usable(lease):
+                lease = self._latest(partner)
+                if not self._usable(lease):
+                    lease = self._issue(partner)
+                self.leases[partner.id] = lease
+            return lease
+
+    def _latest(self, partner):
+        # Leases issued before their passwords were encrypted are only
+        # left to be revoked.
+        return models.JenkinsLease.objects.filter(partner=partner) \
+            .exclude(encryptedPassword='').order_by('-expires').first()
+
+    def _issue(self, partner, margin=None):
+        user = str(partner.shortName + '_jenkins')
+        password = randomPassword()
+        passwdHash = hashPassword(password)
+
+        with transaction.atomic():
+            # Another process may have issued a lease meanwhile.
+            lease = self._latest(partner)
+            if self._usable(lease, margin):
+                return lease
+
+            utils._addPassword(settings.LDAP_USER_DN_TEMPLATE % user,
+                               passwdHash)
+            expires = timezone.now() + \
+                timedelta(seconds=settings.JENKINS_LEASE_TTL)
+            return models.JenkinsLease.objects.create(
+                partner=partner, user=user,
+                encryptedPassword=encryptPassword(password),
+                hash=passwdHash, expires=expires)
+
+    def renew(self):
+        """Issue new leases for the partners in use whose lease runs out.
+
+        Partners are in use while their latest lease has not expired.
+        """
+        margin = 2 * settings.JENKINS_LEASE_GRACE
+        partners = models.Partner.objects.filter(
+            active=True, jenkinslease__expires__gt=timezone.now()).distinct()
+        for partner in partners:
+            with self._partnerLock(partner.id):
+                lease = self._latest(partner)
+                if not self._usable(lease, margin):
+                    self._issue(partner, margin)
+
+    def revoke(self):
+        """Remove expired leases passwords from LDAP."""
+        expired = models.JenkinsLease.objects.filter(
+            expires__lte=timezone.now())
+        for lease in expired:
+            utils._removePassword(settings.LDAP_USER_DN_TEMPLATE % lease.user,
+                                  lease.hash)
+            lease.delete()
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-14 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0005_partner_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JenkinsLease',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(max_length=40)),
+                ('password', models.CharField(max_length=64)),
+                ('hash', models.CharField(max_length=128)),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('partner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='partner.Partner')),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-28 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0006_jenkinslease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeHealth',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(db_index=True, default='offline', max_length=10)),
+                ('latency', models.FloatField(null=True)),
+                ('lastSeen', models.DateTimeField(null=True)),
+                ('lastChange', models.DateTimeField(null=True)),
+                ('failures', models.IntegerField(default=0)),
+                ('nextProbe', models.DateTimeField(null=True)),
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='health', to='partner.Node')),
+            ],
+        ),
+    ]
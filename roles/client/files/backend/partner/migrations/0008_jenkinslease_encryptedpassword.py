@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-28 14:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0007_nodehealth'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='jenkinslease',
+            name='password',
+        ),
+        migrations.AddField(
+            model_name='jenkinslease',
+            name='encryptedPassword',
+            field=models.CharField(default='', max_length=255),
+        ),
+    ]
@@ -15,16 +15,21 @@
 """Partner models."""
 
 from __future__ import unicode_literals
+from datetime import timedelta
 from os import urandom
 from django import forms
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 import hashlib
 import jenkins
 import threading
+import time
 import uuid
 
 from client import settings
-import account.utils
+import leases
 import utils
 
 
@@ -48,6 +53,24 @@ class Partner(models.Model):
     active = models.BooleanField(default=True)
 
 
+class JenkinsLease(models.Model):
+    """Models a time-boxed password of a partner Jenkins user account.
+
+    Leases are shared by every operation on the partner nodes until they
+    expire (see leases.py). The password is stored encrypted with
+    JENKINS_LEASE_KEY.
+    """
+    partner = models.ForeignKey(Partner, on_delete=models.CASCADE)
+    user = models.CharField(max_length=40)
+    encryptedPassword = models.CharField(max_length=255, default='')
+    hash = models.CharField(max_length=128)
+    expires = models.DateTimeField(db_index=True)
+
+    @property
+    def password(self):
+        return leases.decryptPassword(self.encryptedPassword)
+
+
 class PartnerForm(forms.ModelForm):
     """Auto generates HTML forms for partner model."""
 
@@ -80,39 +103,54 @@ class Node(models.Model):
 
         # self._lock()
 
-        jUser, jPassword, passwdHash = utils.getJenkinsUser(self.site)
+        lease = leases.CredentialLeaseManager.get().acquire(self.site)
         jConn = jenkins.Jenkins(utils.JENKINS_URL
                                 % {'host': self.host,
                                    'port': self.port},
-                                jUser, jPassword)
+                                lease.user, lease.password,
+                                timeout=settings.NODE_TIMEOUT)
         self.conn = {
-            'user': jUser,
-            'passwd': jPassword,
-            'hash': passwdHash,
+            'user': lease.user,
+            'passwd': lease.password,
             'conn': jConn
         }
         return jConn
 
     def disconnect(self):
         """Disconnect from the node."""
-        userdn = settings.LDAP_USER_DN_TEMPLATE % self.conn['user']
-        newHash = account.utils.hashPassword(account.utils.randomPassword())
-        account.utils.changePassword(userdn, self.conn['hash'], newHash)
-
         # self._unlock()
 
         self.conn = None
 
     def status(self):
         """Return node availability ('online' or 'offline')."""
+        health = self.getHealth()
+        if health.stale():
+            return 'offline'
+        return health.status
+
+    def getHealth(self):
+        """Return the node last known health (see NodeHealth)."""
+        try:
+            return self.health
+        except NodeHealth.DoesNotExist:
+            return NodeHealth(node=self)
+
+    def probe(self):
+        """Check the node availability against its Jenkins.
+
+        Returns:
+            tuple: ('online' or 'offline', seconds the check took).
+        """
+        start = time.time()
         jConn = self.connect()
         try:
             jConn.get_version()
         except:
-            return "offline"
+            return "offline", time.time() - start
         finally:
             self.disconnect()
-        return "online"
+        return "online", time.time() - start
 
     def _lock(self):
         try:
@@ -123,3 +161,35 @@ class Node(models.Model):
 
     def _unlock(self):
         Node.locks[self.id].release()
+
+
+class NodeHealth(models.Model):
+    """Models the last known availability of a node.
+
+    Nodes are probed by a single process (see health.py). Nodes not probed
+    yet are reported offline.
+    """
+    node = models.OneToOneField(Node, on_delete=models.CASCADE,
+                                related_name='health')
+    status = models.CharField(max_length=10, default='offline',
+                              db_index=True)
+    latency = models.FloatField(null=True)
+    lastSeen = models.DateTimeField(null=True)
+    lastChange = models.DateTimeField(null=True)
+    failures = models.IntegerField(default=0)
+    nextProbe = models.DateTimeField(null=True)
+
+    @staticmethod
+    def staleBefore():
+        """Return the time before which an overdue probe means no prober."""
+        return timezone.now() - \
+            timedelta(seconds=settings.NODE_HEALTH_MAX_BACKOFF)
+
+    def stale(self):
+        return self.nextProbe is None or \
+            self.nextProbe <= NodeHealth.staleBefore()
+
+
+@receiver([post_save, post_delete], sender=Node)
+def _invalidateWhitelist(sender, **kwargs):
+    utils.invalidateWhitelist()
@@ -14,21 +14,44 @@
 
 """Utils functions when dealing with nodes and partners"""
 
+from django.core.cache import cache
+from multiprocessing.pool import ThreadPool
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import Request, urlopen
+import Queue
 import datetime
-import gear
+import hashlib
+import jenkins
+import json
 import ldap
 import ldap.modlist as modlist
+import logging
 import pytz
-import re
 import threading
 import time
 
+from account.ldappool import LDAPConnectionPool
 from account.utils import randomPassword, hashPassword
-from client import settings, secret
+from client import settings
+import gearadmin
 import models
 
 
+logger = logging.getLogger(__name__)
+
 JENKINS_URL = 'http://%(host)s:%(port)s/'
+BUILD_SUMMARIES_URL = 'job/%(name)s/api/json?' \
+    'tree=builds[number,result,timestamp,duration]{0,%(depth)d}'
+BUILD_SUMMARY_URL = 'job/%(name)s/%(number)d/api/json?' \
+    'tree=number,result,timestamp,duration'
+LAST_BUILDS_URL = 'api/json?' \
+    'tree=jobs[name,lastBuild[number,result,timestamp,duration]]'
+PROGRESSIVE_TEXT_URL = 'job/%(name)s/%(number)d/logText/progressiveText?' \
+    'start=%(start)d'
+WHITELIST_CACHE_KEY = 'partner.whitelist'
+
+_nodePool = None
+_nodePoolLock = threading.Lock()
 
 
 def getJenkinsUser(partner, usingPassword=None, isAdmin=False):
@@ -42,14 +65,8 @@ def getJenkinsUser(partner, usingPassword=None, isAdmin=False):
         dn = settings.LDAP_USER_DN_TEMPLATE \
              % str(partner.shortName + '_jenkins')
 
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-    ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-    l = ldap.initialize(secret.LDAP_URI)
-    l.protocol_version = ldap.VERSION3
-    l.start_tls_s()
-    l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
-    result = l.search_s(dn, ldap.SCOPE_SUBTREE)
-    l.unbind_s()
+    with LDAPConnectionPool.get().connection() as l:
+        result = l.search_s(dn, ldap.SCOPE_SUBTREE)
 
     jUser = result[0][1]['uid'][0]
     oldHash = result[0][1]['userPassword'][0]
@@ -65,64 +82,128 @@ def getJenkinsUser(partner, usingPassword=None, isAdmin=False):
 
 
 def _changePassword(dn, oldHash, newHash):
-    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_DEMAND)
-    ldap.set_option(ldap.OPT_X_TLS_CACERTFILE, settings.LDAP_CACERTFILE)
-    l = ldap.initialize(secret.LDAP_URI)
-    l.protocol_version = ldap.VERSION3
-    l.start_tls_s()
-    l.simple_bind_s(secret.LDAP_BIND_DN, secret.LDAP_BIND_PASSWORD)
     ldif = modlist.modifyModlist({'userPassword': oldHash},
                                  {'userPassword': newHash})
-    l.modify_s(dn, ldif)
-    l.unbind_s
+    with LDAPConnectionPool.get().connection() as l:
+        l.modify_s(dn, ldif)
 
 
-class WorkersAdminRequest(gear.AdminRequest):
-    """A "workers" administrative request.
+def _addPassword(dn, newHash):
+    """Add a password to an user, keeping the passwords it already has."""
+    with LDAPConnectionPool.get().connection() as l:
+        l.modify_s(dn, [(ldap.MOD_ADD, 'userPassword', newHash)])
 
-    The response from gearman may be found in the **response** attribute.
-    """
 
-    command = b'workers'
+def _removePassword(dn, oldHash):
+    """Remove one of the passwords of an user, if it still has it."""
+    with LDAPConnectionPool.get().connection() as l:
+        try:
+            l.modify_s(dn, [(ldap.MOD_DELETE, 'userPassword', oldHash)])
+        except ldap.NO_SUCH_ATTRIBUTE:
+            pass
 
-    def __init__(self):
-        super(WorkersAdminRequest, self).__init__()
 
+def getWhitelist():
+    """Return the hosts of the registered nodes, to be let in by Gearman."""
+    hosts = models.Node.objects.exclude(host='0.0.0.0') \
+        .order_by('host').values_list('host', flat=True).distinct()
+    return [str(host) for host in hosts]
 
-def getJenkinsFromGearman(gclient):
-    workersAdminRequest = WorkersAdminRequest()
-    gclient.getConnection().sendAdminRequest(workersAdminRequest)
-    workersAdminRequest.waitForResponse()
 
-    response = str(workersAdminRequest.response)
-    iplist = list(re.findall(r'(?:[0-9]{1,3}\.){3}[0-9]{1,3}', response))
+def getCachedWhitelist():
+    """Return the whitelist text and its ETag, from cache when possible.
 
-    # Remove client IPs from list.
-    for match in re.findall(r'(?:[0-9]{1,3}\.){3}[0-9]{1,3} - ', response):
-        iplist.remove(match[:-3])
+    The cache is cleared when a node is saved or deleted (see models.py),
+    and kept WHITELIST_CACHE_TTL seconds at most otherwise, as changes made
+    by other processes do not clear a process local cache.
 
-    # list( set( anylist ) ) removes repeated elements from anylist.
-    return list(set(iplist))
+    Returns:
+        tuple: (ETag, whitelist text).
+    """
+    cached = cache.get(WHITELIST_CACHE_KEY)
+    if cached is None:
+        text = '\n'.join(getWhitelist())
+        cached = (hashlib.sha1(text).hexdigest(), text)
+        cache.set(WHITELIST_CACHE_KEY, cached, settings.WHITELIST_CACHE_TTL)
+    return cached
+
+
+def invalidateWhitelist():
+    cache.delete(WHITELIST_CACHE_KEY)
 
 
 def getNodesIpList():
-    gclient = gear.Client()
-    gclient.addServer(settings.GEARMAN_HOST)
-    gclient.waitForServer()
-    jenkinsIPList = getJenkinsFromGearman(gclient)
-    gclient.shutdown()
-    return jenkinsIPList
+    """Return the IP addresses of the Gearman workers, i.e. Jenkins nodes."""
+    return gearadmin.GearmanRegistry.get().current().nodeIps()
 
 
-def getOnlineNodes():
-    nodes = models.Node.objects.filter(site__active=True)
-    onlineNodes = []
+def _getNodePool():
+    global _nodePool
+    with _nodePoolLock:
+        if _nodePool is None:
+            _nodePool = ThreadPool(settings.NODE_POOL_SIZE)
+    return _nodePool
+
+
+def mapNodes(function, nodes, timeout=None):
+    """Run function(node) for all nodes at once in the shared node pool.
+
+    Results are yielded as they arrive, so callers can merge them without
+    waiting for the slowest node. Nodes that fail or do not answer within
+    timeout seconds are logged and left out.
+
+    Args:
+        function (callable): Function receiving a node.
+        nodes (list): Nodes to run function for.
+        timeout (int): Seconds to wait for the nodes. Defaults to
+            settings.NODE_TIMEOUT.
+
+    Yields:
+        tuple: (node, function(node)).
+    """
+    if timeout is None:
+        timeout = settings.NODE_TIMEOUT
+
+    results = Queue.Queue()
+
+    def run(node):
+        try:
+            return node, function(node), None
+        except Exception as e:
+            return node, None, e
 
+    pool = _getNodePool()
     for node in nodes:
-        if node.status() == 'online':
-            onlineNodes.append(node)
+        pool.apply_async(run, (node,), callback=results.put)
 
-    return onlineNodes
+    deadline = time.time() + timeout
+    for i in xrange(len(nodes)):
+        try:
+            node, result, error = results.get(
+                timeout=max(deadline - time.time(), 0))
+        except Queue.Empty:
+            logger.warning('%d node(s) did not answer within %s seconds',
+                           len(nodes) - i, timeout)
+            return
+
+        if error is None:
+            yield node, result
+        else:
+            logger.warning('Node %s:%s failed: %s', node.host, node.port,
+                           error)
+
+
+def getOnlineNodes():
+    """Return the active nodes last probed online (see health.py).
+
+    Nodes whose next probe is overdue by more than NODE_HEALTH_MAX_BACKOFF
+    seconds are left out, so nodes are not trusted online forever when the
+    prober stopped.
+    """
+    return list(models.Node.objects.filter(
+        site__active=True, health__status='online',
+        health__nextProbe__gt=models.NodeHealth.staleBefore())
+        .select_related('site'))
 
 
 def _compairBuildsTimestamp(x, y):
@@ -134,94 +215,151 @@ def _compairBuildsTimestamp(x, y):
         return -1
 
 
-def getBuildInformation(jobName):
-    nodes = getOnlineNodes()
-    bvalues = []
-    builds = {}
-
-    for i, node in zip(xrange(len(nodes)), nodes):
-        jconn = node.connect()
+def _toDatetime(javaTimestamp):
+    """Convert a Java timestamp (ms since epoch) to an aware datetime."""
+    return pytz.utc.localize(
+        datetime.datetime(*time.gmtime(javaTimestamp / 1000.0)[:6]))
 
-        if jconn.job_exists(jobName):
-            jobJSON = jconn.get_job_info(jobName)
-        else:
-            continue
 
-        nodeName = 'jenkins' + str(i)
-        nodeLock = threading.Lock()
+def getBuildSummaries(jconn, jobName, depth=None):
+    """Get number, result, timestamp and duration of the builds of a job.
 
-        asyncGetBuildInfo = AsyncGetBuildInfo(
-            nodeName, jobName, jobJSON['builds'], builds, jconn, nodeLock)
-        asyncGetBuildInfo.start()
+    All builds are fetched in a single request using the Jenkins tree API.
 
-        asyncGetBuildConsoleOutput = AsyncGetBuildConsoleOutput(
-            nodeName, jobName, jobJSON['builds'], builds, jconn, nodeLock)
-        asyncGetBuildConsoleOutput.start()
+    Args:
+        jconn (Jenkins): Connection to the node Jenkins.
+        jobName (str): Job name.
+        depth (int): Maximum amount of builds to fetch, newest first.
+            Defaults to settings.BUILD_HISTORY_DEPTH.
 
-        asyncGetBuildInfo.join()
-        asyncGetBuildConsoleOutput.join()
+    Returns:
+        list: Dicts with number, result, timestamp and duration of each
+            build, newest first.
 
-        node.disconnect()
+    Raises:
+        jenkins.NotFoundException: When the node has no such job.
+    """
+    if depth is None:
+        depth = settings.BUILD_HISTORY_DEPTH
+    url = jconn._build_url(BUILD_SUMMARIES_URL,
+                           {'name': jobName, 'depth': depth})
+    jobJSON = json.loads(jconn.jenkins_open(Request(url)))
 
-        bvalues.extend(builds.values())
-        builds.clear()
+    return [{'number': b['number'],
+             'result': b['result'],
+             'timestamp': _toDatetime(b['timestamp']),
+             'duration': b['duration']}
+            for b in jobJSON.get('builds', [])]
 
-    # Sort builds by timestamp descending.
-    # Sorting by first element is faster than using a compair function.
-    sort_aux = [(b['timestamp'], b) for b in bvalues]
-    sort_aux.sort(reverse=True)
-    bvalues = [b for (timestamp, b) in sort_aux]
-    return bvalues
 
+def getBuildSummary(jconn, jobName, number):
+    """Get number, result, timestamp and duration of a build.
 
-class AsyncBuildInfoGetter(threading.Thread):
+    Args:
+        jconn (Jenkins): Connection to the node Jenkins.
+        jobName (str): Job name.
+        number (int): Build number.
 
-    def __init__(self, nodeName, jobName, rawbuilds, builds, jconn, lock):
-        super(AsyncBuildInfoGetter, self).__init__()
-        self.nodeName = nodeName
-        self.jobName = jobName
-        self.jconn = jconn
-        self.rawbuilds = rawbuilds
-        self.builds = builds
-        self.lock = lock
+    Returns:
+        dict: Number, result, timestamp and duration of the build.
 
-    def updateBuildData(self, buildKey, buildData):
-        self.lock.acquire(True)
-        try:
-            self.builds[buildKey].update(buildData)
-        except:
-            self.builds[buildKey] = buildData
-        self.lock.release()
+    Raises:
+        jenkins.NotFoundException: When the node has no such build.
+    """
+    url = jconn._build_url(BUILD_SUMMARY_URL,
+                           {'name': jobName, 'number': number})
+    build = json.loads(jconn.jenkins_open(Request(url)))
+    return {'number': build['number'],
+            'result': build['result'],
+            'timestamp': _toDatetime(build['timestamp']),
+            'duration': build['duration']}
 
 
-class AsyncGetBuildInfo(AsyncBuildInfoGetter):
+def getLastBuilds(jconn):
+    """Get the last build of every job of a node in a single request.
 
-    def run(self):
-        for b in self.rawbuilds:
-            build = self.jconn.get_build_info(self.jobName, b['number'])
+    Args:
+        jconn (Jenkins): Connection to the node Jenkins.
 
-            # Gets timestamp and convert from Java representation to python
-            # representation.
-            build['timestamp'] = pytz.utc.localize(
-                datetime.datetime(
-                    *time.gmtime(build['timestamp'] / 1000.0)[:6]))
+    Returns:
+        dict: Job names mapped to a dict with number, result, timestamp and
+            duration of their last build, or to None if never built.
+    """
+    url = jconn._build_url(LAST_BUILDS_URL)
+    nodeJSON = json.loads(jconn.jenkins_open(Request(url)))
+
+    lastBuilds = {}
+    for job in nodeJSON.get('jobs', []):
+        build = job.get('lastBuild')
+        if build is not None:
+            build = {'number': build['number'],
+                     'result': build['result'],
+                     'timestamp': _toDatetime(build['timestamp']),
+                     'duration': build['duration']}
+        lastBuilds[str(job['name'])] = build
+    return lastBuilds
+
+
+def getNodeBuildInformation(jconn, jobName, since=0):
+    """Get the builds of a job run by a single node.
+
+    Args:
+        jconn (Jenkins): Connection to the node Jenkins.
+        jobName (str): Job name.
+        since (int): Only builds numbered above since are returned.
+
+    Returns:
+        list: Dicts with number, result, timestamp and duration of each
+            build, newest first.
+    """
+    return [b for b in getBuildSummaries(jconn, jobName)
+            if b['number'] > since]
 
-            buildData = {'name': self.nodeName + 'build' +
-                         str(build['number']),
-                         'timestamp': build['timestamp'],
-                         'result': build['result']}
 
-            self.updateBuildData(b['number'], buildData)
+def getConsoleText(jconn, jobName, number, start=0, limit=None):
+    """Get part of a build console output.
 
+    Mirrors the Jenkins progressiveText API: the text is returned from the
+    start byte offset on, along with the offset to continue reading from.
 
-class AsyncGetBuildConsoleOutput(AsyncBuildInfoGetter):
+    Args:
+        jconn (Jenkins): Connection to the node Jenkins.
+        jobName (str): Job name.
+        number (int): Build number.
+        start (int): Byte offset to start reading from.
+        limit (int): Maximum amount of bytes to read. None reads everything.
 
-    def run(self):
-        for b in self.rawbuilds:
-            # Get build console output.
-            consoleOutput = self.jconn.get_build_console_output(self.jobName,
-                                                                b['number'])
+    Returns:
+        tuple: (text, next start offset, True if there is more text to read
+            either because of limit or because the build is still running).
 
-            buildData = {'consoleOutput': consoleOutput}
+    Raises:
+        jenkins.NotFoundException: When the node has no such build.
+    """
+    url = jconn._build_url(PROGRESSIVE_TEXT_URL,
+                           {'name': jobName, 'number': number,
+                            'start': start})
+    req = Request(url)
+    if jconn.auth:
+        req.add_header('Authorization', jconn.auth)
+
+    try:
+        response = urlopen(req, timeout=jconn.timeout)
+    except HTTPError as e:
+        if e.code == 404:
+            raise jenkins.NotFoundException(
+                'job[%s] number[%d] does not exist' % (jobName, number))
+        raise
+
+    try:
+        textSize = int(response.info().get('X-Text-Size', 0))
+        moreData = response.info().get('X-More-Data') == 'true'
+        if limit is None:
+            text = response.read()
+        else:
+            text = response.read(limit)
+    finally:
+        response.close()
 
-            self.updateBuildData(b['number'], buildData)
+    nextStart = start + len(text)
+    return text, nextStart, moreData or nextStart < textSize
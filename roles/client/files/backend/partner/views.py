@@ -18,12 +18,10 @@ from django.core import urlresolvers
 from django.http import HttpResponse, Http404
 from django.shortcuts import render, redirect
 from django.views.decorators.csrf import ensure_csrf_cookie
-from paramiko.client import SSHClient
-import paramiko
+from django.views.decorators.http import condition
 import simplejson
 import yaml
 
-from client import settings
 import account.utils
 import models
 import utils
@@ -70,24 +68,8 @@ def registerNode(request):
     node.port = port
     node.save()
 
-    # TODO: whitelist node at gearman firewall
-    sshClient = SSHClient()
-    sshClient.load_system_host_keys()
-    sshClient.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    sshClient.connect(settings.GEARMAN_HOST,
-                      int(settings.GEARMAN_SSH_PORT),
-                      settings.GEARMAN_SSH_USER)
-    command = 'sudo /sbin/iptables -vnL | awk \'{print $8}\''
-    stdin, stdout, stderr = sshClient.exec_command(command)
-
-    ips = [str(ip).strip() for ip in stdout.readlines()]
-
-    if node.host not in ips:
-        command = 'sudo /sbin/iptables -A INPUT -s %(host)s -j ACCEPT' \
-                  % {'host': node.host}
-        stdin, stdout, stderr = sshClient.exec_command(command)
-    sshClient.close()
-
+    # The node is whitelisted at the Gearman firewall by the syncfirewall
+    # command.
     return HttpResponse('ok')
 
 
@@ -122,17 +104,15 @@ def _generatePartnerArtifacts(partner, nodeAmount):
     return True
 
 
+def _whitelistETag(request):
+    return utils.getCachedWhitelist()[0]
+
+
 # Security fault :(
 # This method publishs all partners jenkins addresses
+@condition(etag_func=_whitelistETag)
 def whitelist(request):
-    nodes = models.Node.objects.all()
-    ips = []
-    for node in nodes:
-        ip = str(node.host)
-        if ip != '0.0.0.0' and ip not in ips:
-            ips.append(ip)
-    ips = '\n'.join(ips)
-    return HttpResponse(ips)
+    return HttpResponse(utils.getCachedWhitelist()[1])
 
 
 @staff_member_required
@@ -0,0 +1,131 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Incremental synchronization of partner nodes builds into Build table."""
+
+import logging
+import time
+
+from client import settings
+from logarchive import LogArchive
+import models
+import partner.utils
+
+
+logger = logging.getLogger(__name__)
+
+
+class BuildPoller(object):
+    """Records new builds of every project job from every online node.
+
+    The last build of every job of a node is fetched in a single request.
+    Only jobs whose last build is not recorded yet are then asked for the
+    build numbers above the last one already recorded. Nodes are polled
+    all at once, while builds are recorded from the calling thread.
+    The console output archive is pruned every LOG_ARCHIVE_PRUNE_INTERVAL
+    seconds, as walking it costs much more than a poll.
+    """
+
+    def __init__(self):
+        self.archive = LogArchive.get()
+        self.lastPruned = 0
+
+    def poll(self):
+        projects = {str(p.name): p for p in models.Project.objects.all()}
+
+        def pollNode(node):
+            return self._pollNode(node, projects)
+
+        for node, builds in partner.utils.mapNodes(
+                pollNode, partner.utils.getOnlineNodes(),
+                settings.BUILD_POLL_TIMEOUT):
+            for project, build in builds:
+                self._record(project, node, build)
+
+        if time.time() - self.lastPruned >= \
+                settings.LOG_ARCHIVE_PRUNE_INTERVAL:
+            self.archive.prune()
+            self.lastPruned = time.time()
+
+    def _pollNode(self, node, projects):
+        jconn = node.connect()
+        try:
+            lastBuilds = partner.utils.getLastBuilds(jconn)
+            # Jobs of deleted projects belong to no project, even when a
+            # project of the same name was created since.
+            buried = models.JobTombstone.buriedOn(node)
+
+            newBuilds = []
+            for jobName, lastBuild in lastBuilds.items():
+                project = projects.get(jobName)
+                if project is None or lastBuild is None or \
+                        jobName in buried:
+                    continue
+
+                since = models.Build.lastSyncedNumber(project, node)
+                if lastBuild['number'] <= since:
+                    continue
+                builds = partner.utils.getNodeBuildInformation(jconn, jobName,
+                                                               since)
+                for build in builds:
+                    if build['result'] is not None:
+                        archiveBuild(node, project.id, jobName,
+                                     build['number'], jconn)
+                    newBuilds.append((project, build))
+            return newBuilds
+        finally:
+            node.disconnect()
+
+    def _record(self, project, node, build):
+        models.Build.objects.update_or_create(
+            project=project, node=node, number=build['number'],
+            defaults={'result': build['result'],
+                      'timestamp': build['timestamp'],
+                      'duration': build['duration']})
+
+
+def archiveBuild(node, projectId, jobName, number, jconn=None):
+    """Store the console output of a finished build locally.
+
+    Args:
+        projectId (int): Id of the project the build belongs to.
+        jconn (Jenkins): Connection to the node. The node is connected to
+            when None.
+    """
+    archive = LogArchive.get()
+    if archive.exists(projectId, node.id, number):
+        return
+    connected = jconn is None
+    try:
+        if connected:
+            jconn = node.connect()
+        archive.store(projectId, node.id, number,
+                      _consoleChunks(jconn, jobName, number))
+    except Exception:
+        logger.exception('Failed to archive console output of %s #%d',
+                         jobName, number)
+    finally:
+        if connected:
+            node.disconnect()
+
+
+def _consoleChunks(jconn, jobName, number):
+    start = 0
+    moreData = True
+    while moreData:
+        text, start, moreData = partner.utils.getConsoleText(
+            jconn, jobName, number, start, settings.CONSOLE_OUTPUT_PAGE_SIZE)
+        if not text:
+            break
+        yield text
@@ -0,0 +1,198 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Submission and recording of the builds requested from the web.
+
+Build requests (see models.BuildRequest) are submitted as foreground
+Gearman jobs by the trackbuilds command, so a single long-lived process
+holds them until they finish.
+
+The Jenkins Gearman plugin sends a WORK_DATA packet describing the build
+(job name, build number and URL) when it starts, and the same description
+with the build result in the WORK_COMPLETE packet when it finishes. Builds
+are recorded from these packets, so they show up without waiting for the
+build poller, with their timestamp and duration as told by the node. The
+poller still records builds whose packets were missed.
+"""
+
+from django.utils import timezone
+from six.moves.urllib.parse import urlparse
+import Queue
+import json
+import logging
+import threading
+
+from project.utils import getGearClient
+import buildpoller
+import models
+import partner.models
+import partner.utils
+
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedBuild(object):
+    """A build job submitted to Gearman and what is known about its run."""
+
+    def __init__(self, project):
+        self.projectId = project.id
+        self.jobName = project.name
+        self.node = None
+        self.number = None
+
+
+class BuildTracker(threading.Thread):
+    """Records builds from the Gearman packets of their jobs.
+
+    Packets are received by the Gearman client polling thread and queued,
+    so database and node accesses happen in the tracker thread.
+    """
+
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    def __init__(self):
+        super(BuildTracker, self).__init__()
+        self.daemon = True
+        self.tracked = {}
+        self.lock = threading.Lock()
+        self.events = Queue.Queue()
+
+    @staticmethod
+    def get():
+        with BuildTracker._instanceLock:
+            if BuildTracker._instance is None:
+                tracker = BuildTracker()
+                getGearClient().jobListeners.append(tracker.onJobEvent)
+                tracker.start()
+                BuildTracker._instance = tracker
+            return BuildTracker._instance
+
+    def submitPending(self):
+        """Submit the requested builds as foreground jobs and track them.
+
+        Requests that fail to be submitted are kept and tried again.
+
+        Returns:
+            int: The amount of builds submitted.
+        """
+        submitted = 0
+        for request in models.BuildRequest.pending():
+            try:
+                self.submit(request.project)
+            except Exception:
+                logger.exception('Failed to submit build of %s',
+                                 request.project.name)
+                continue
+            request.delete()
+            submitted += 1
+        return submitted
+
+    def submit(self, project):
+        # Gearman only reports the progress of foreground jobs.
+        jobs = project.buildJobs()
+        self.track(project, jobs)
+        try:
+            getGearClient().submitJobs(jobs, background=False)
+        except:
+            self.forget(jobs)
+            raise
+
+    def track(self, project, jobs):
+        """Record the builds of jobs, before they are submitted."""
+        with self.lock:
+            for job in jobs:
+                self.tracked[job.unique] = TrackedBuild(project)
+
+    def forget(self, jobs):
+        with self.lock:
+            for job in jobs:
+                self.tracked.pop(job.unique, None)
+
+    def onJobEvent(self, job, event, data):
+        with self.lock:
+            if job.unique not in self.tracked:
+                return
+        # Progress reports tell nothing about the build itself.
+        if event != 'status':
+            self.events.put((job.unique, event, data))
+
+    def run(self):
+        while True:
+            unique, event, data = self.events.get()
+            try:
+                self._handle(unique, event, data)
+            except Exception:
+                logger.exception('Failed to record build of job %s', unique)
+
+    def _handle(self, unique, event, data):
+        with self.lock:
+            build = self.tracked.get(unique)
+            if build is None:
+                return
+            if event != 'data':
+                del self.tracked[unique]
+
+        description = _parseDescription(data) \
+            if event in ('data', 'complete') else None
+        if description is not None and build.number is None:
+            build.node = partner.models.Node.objects.filter(
+                host=description['host'], port=description['port']).first()
+            if build.node is None:
+                logger.warning('Build %s ran on an unknown node',
+                               description['url'])
+            else:
+                build.number = description['number']
+
+        # Builds that never started, ran on an unknown node or failed
+        # without telling their result are left to the build poller.
+        if build.number is None or event not in ('data', 'complete'):
+            return
+
+        jconn = build.node.connect()
+        try:
+            summary = partner.utils.getBuildSummary(jconn, build.jobName,
+                                                    build.number)
+            record, created = models.Build.objects.get_or_create(
+                project_id=build.projectId, node=build.node,
+                number=build.number,
+                defaults={'timestamp': summary['timestamp']})
+            if event != 'complete':
+                return
+
+            record.timestamp = summary['timestamp']
+            record.result = description and description.get('result') or \
+                summary['result']
+            record.duration = summary['duration'] or int(
+                (timezone.now() - record.timestamp).total_seconds() * 1000)
+            record.save(update_fields=['timestamp', 'result', 'duration'])
+            if record.result is not None:
+                buildpoller.archiveBuild(build.node, build.projectId,
+                                         build.jobName, build.number, jconn)
+        finally:
+            build.node.disconnect()
+
+
+def _parseDescription(data):
+    """Parse the build description sent by the Jenkins Gearman plugin."""
+    try:
+        description = json.loads(data)
+        url = urlparse(description['url'])
+        description['number'] = int(description['number'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    description['host'] = url.hostname
+    description['port'] = url.port or 80
+    return description
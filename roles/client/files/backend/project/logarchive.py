@@ -0,0 +1,293 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+"""Compressed on-disk archive of builds console output.
+
+Each log is stored as two files:
+    * <number>.log: the log split into blocks of about BLOCK_SIZE bytes,
+      each block compressed on its own with zlib.
+    * <number>.idx: a header with the log size and line count followed by
+      one record per block, used to find and decompress only the blocks
+      covering a byte or line range.
+
+Logs are keyed by (project id, node id, build number) and stored under
+projects/<project id>/<node id>/. Project ids are never reused, so a project
+created with the name of a deleted one never sees its logs.
+"""
+
+from bisect import bisect_right
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+from client import settings
+
+
+BLOCK_SIZE = 64 * 1024
+
+_HEADER = struct.Struct('<8sQQ')
+_MAGIC = b'CILOG001'
+# Uncompressed offset, first line number, compressed offset, compressed
+# length and whether the block starts in the middle of a line.
+_RECORD = struct.Struct('<QQQI?')
+
+
+class _LogIndex(object):
+
+    def __init__(self, size, lines, records):
+        self.size = size
+        self.lines = lines
+        self.records = records
+        self.offsets = [r[0] for r in records]
+        self.firstLines = [r[1] for r in records]
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as idx:
+            data = idx.read()
+        magic, size, lines = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise IOError('Not a log archive index: %s' % path)
+        records = [_RECORD.unpack_from(data, pos) for pos in
+                   xrange(_HEADER.size, len(data), _RECORD.size)]
+        return _LogIndex(size, lines, records)
+
+    def dump(self, idx):
+        idx.write(_HEADER.pack(_MAGIC, self.size, self.lines))
+        for record in self.records:
+            idx.write(_RECORD.pack(*record))
+
+
+class _LogWriter(object):
+    """Splits a log in line aligned blocks and compresses each of them."""
+
+    def __init__(self, data):
+        self.data = data
+        self.buffer = b''
+        self.size = 0
+        self.lines = 0
+        self.compressedSize = 0
+        self.midLine = False
+        self.records = []
+
+    def write(self, text):
+        self.buffer += text
+        while len(self.buffer) >= BLOCK_SIZE:
+            cut = self.buffer.rfind(b'\n', 0, BLOCK_SIZE) + 1
+            if cut == 0:
+                cut = BLOCK_SIZE
+            self._flushBlock(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+
+    def close(self):
+        if self.buffer:
+            self._flushBlock(self.buffer)
+            self.buffer = b''
+        lines = self.lines + (1 if self.midLine else 0)
+        return _LogIndex(self.size, lines, self.records)
+
+    def _flushBlock(self, block):
+        compressed = zlib.compress(block)
+        self.records.append((self.size, self.lines, self.compressedSize,
+                             len(compressed), self.midLine))
+        self.data.write(compressed)
+        self.size += len(block)
+        self.lines += block.count(b'\n')
+        self.compressedSize += len(compressed)
+        self.midLine = not block.endswith(b'\n')
+
+
+class _LogReader(object):
+    """Random access to an archived log through a memory map."""
+
+    def __init__(self, dataPath, indexPath):
+        self.index = _LogIndex.load(indexPath)
+        self.file = open(dataPath, 'rb')
+        if self.index.records:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        else:
+            self.map = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def _block(self, i):
+        offset, firstLine, cOffset, cLength, midLine = self.index.records[i]
+        return zlib.decompress(self.map[cOffset:cOffset + cLength])
+
+    def readBytes(self, start, limit):
+        end = self.index.size if limit is None \
+            else min(start + limit, self.index.size)
+        if start >= end:
+            return b''
+
+        first = bisect_right(self.index.offsets, start) - 1
+        chunks = []
+        for i in xrange(first, len(self.index.records)):
+            blockStart = self.index.offsets[i]
+            if blockStart >= end:
+                break
+            block = self._block(i)
+            chunks.append(block[max(start - blockStart, 0):end - blockStart])
+        return b''.join(chunks)
+
+    def readLines(self, start, count):
+        count = min(count, self.index.lines - start)
+        if count <= 0:
+            return []
+
+        # Find the block where the line begins.
+        first = bisect_right(self.index.firstLines, start) - 1
+        while first > 0 and self.index.records[first][4]:
+            first -= 1
+
+        skip = start - self.index.firstLines[first]
+        text = b''
+        for i in xrange(first, len(self.index.records)):
+            text += self._block(i)
+            if text.count(b'\n') >= skip + count:
+                break
+        return text.split(b'\n')[skip:skip + count]
+
+
+class LogArchive(object):
+    """Stores and serves builds console output from local disk."""
+
+    _instance = None
+
+    def __init__(self, root=None):
+        self.root = root or settings.LOG_ARCHIVE_DIR
+
+    @staticmethod
+    def get():
+        if LogArchive._instance is None:
+            LogArchive._instance = LogArchive()
+        return LogArchive._instance
+
+    def _projectDirectory(self, projectId):
+        return os.path.join(self.root, 'projects', str(projectId))
+
+    def _paths(self, projectId, nodeId, number):
+        directory = os.path.join(self._projectDirectory(projectId),
+                                 str(nodeId))
+        base = os.path.join(directory, str(number))
+        return directory, base + '.log', base + '.idx'
+
+    def exists(self, projectId, nodeId, number):
+        return os.path.exists(self._paths(projectId, nodeId, number)[2])
+
+    def store(self, projectId, nodeId, number, chunks):
+        """Archive a log given as an iterable of text chunks."""
+        directory, dataPath, indexPath = self._paths(projectId, nodeId, number)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Write to temporary files and rename them so readers never see a
+        # partial log. The index is renamed last as it marks the log as
+        # archived.
+        data = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        index = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+        try:
+            writer = _LogWriter(data)
+            for chunk in chunks:
+                writer.write(chunk)
+            writer.close().dump(index)
+            data.close()
+            index.close()
+            os.rename(data.name, dataPath)
+            os.rename(index.name, indexPath)
+        except:
+            data.close()
+            index.close()
+            for path in (data.name, index.name):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+    def _open(self, projectId, nodeId, number):
+        directory, dataPath, indexPath = self._paths(projectId, nodeId, number)
+        return _LogReader(dataPath, indexPath)
+
+    def readBytes(self, projectId, nodeId, number, start=0, limit=None):
+        """Read a byte range of an archived log.
+
+        Returns:
+            tuple: (text, next start offset, True if there is more text).
+        """
+        reader = self._open(projectId, nodeId, number)
+        try:
+            text = reader.readBytes(start, limit)
+            nextStart = start + len(text)
+            return text, nextStart, nextStart < reader.index.size
+        finally:
+            reader.close()
+
+    def readLines(self, projectId, nodeId, number, start=0, count=None):
+        """Read a line range of an archived log.
+
+        Returns:
+            tuple: (list of lines, total amount of lines in the log).
+        """
+        reader = self._open(projectId, nodeId, number)
+        try:
+            if count is None:
+                count = reader.index.lines
+            return reader.readLines(start, count), reader.index.lines
+        finally:
+            reader.close()
+
+    def purge(self, projectId):
+        """Remove every archived log of a project."""
+        shutil.rmtree(self._projectDirectory(projectId), ignore_errors=True)
+
+    def prune(self):
+        """Apply LOG_ARCHIVE_RETENTION_DAYS and LOG_ARCHIVE_MAX_SIZE.
+
+        Logs older than the retention are removed, then the oldest logs are
+        removed until the archive fits in the size budget.
+        """
+        logs = []
+        for directory, dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                if not filename.endswith('.idx'):
+                    continue
+                indexPath = os.path.join(directory, filename)
+                dataPath = indexPath[:-len('.idx')] + '.log'
+                try:
+                    mtime = os.path.getmtime(indexPath)
+                    size = os.path.getsize(indexPath) + \
+                        os.path.getsize(dataPath)
+                except OSError:
+                    continue
+                logs.append((mtime, size, indexPath, dataPath))
+
+        logs.sort(reverse=True)
+        expiration = time.time() - \
+            settings.LOG_ARCHIVE_RETENTION_DAYS * 24 * 60 * 60
+        total = 0
+        for mtime, size, indexPath, dataPath in logs:
+            total += size
+            if mtime < expiration or total > settings.LOG_ARCHIVE_MAX_SIZE:
+                for path in (indexPath, dataPath):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
@@ -0,0 +1,38 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+from django.core.management.base import BaseCommand
+import time
+
+from client import settings
+from project.buildpoller import BuildPoller
+
+
+class Command(BaseCommand):
+    help = 'Poll partner nodes for new builds and record them locally.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Poll a single time and exit.')
+
+    def handle(self, *args, **options):
+        poller = BuildPoller()
+        while True:
+            try:
+                poller.poll()
+            except Exception as e:
+                self.stderr.write('Build polling failed: %s' % e)
+            if options['once']:
+                break
+            time.sleep(settings.BUILD_POLL_INTERVAL)
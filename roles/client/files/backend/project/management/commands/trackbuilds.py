@@ -0,0 +1,35 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+from django.core.management.base import BaseCommand
+import time
+
+from client import settings
+from project.buildtracker import BuildTracker
+
+
+class Command(BaseCommand):
+    help = 'Submit the requested builds and record them as they run.'
+
+    def handle(self, *args, **options):
+        # Builds are foreground jobs held by this process until they end,
+        # so unlike the other commands this one never exits on its own.
+        tracker = BuildTracker.get()
+        while True:
+            try:
+                tracker.submitPending()
+            except Exception as e:
+                self.stderr.write('Build submission failed: %s' % e)
+            time.sleep(settings.BUILD_REQUEST_INTERVAL)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-12 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0005_partner_active'),
+        ('project', '0002_project_nodes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Build',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('result', models.CharField(max_length=20, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('duration', models.IntegerField(default=0)),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='partner.Node')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.Project')),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='build',
+            unique_together=set([('project', 'node', 'number')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='build',
+            index_together=set([('project', 'timestamp')]),
+        ),
+    ]
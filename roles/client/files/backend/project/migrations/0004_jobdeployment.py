@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-19 10:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0006_jenkinslease'),
+        ('project', '0003_build'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='definitionHash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='JobDeployment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='partner.Node')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='project.Project')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='jobdeployment',
+            unique_together=set([('project', 'node')]),
+        ),
+    ]
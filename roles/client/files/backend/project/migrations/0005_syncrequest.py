@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-21 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0004_jobdeployment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRequest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jobName', models.CharField(max_length=100, unique=True)),
+                ('action', models.CharField(choices=[('update', 'Update')], default='update', max_length=10)),
+                ('version', models.IntegerField(default=0)),
+                ('due', models.DateTimeField(db_index=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('lastError', models.TextField(blank=True, default='')),
+                ('project', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='project.Project')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-23 13:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('project', '0005_syncrequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='jobdeployment',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='jobdeployment',
+            name='hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.6 on 2016-09-27 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('partner', '0006_jenkinslease'),
+        ('project', '0006_jobdeployment_error'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jobName', models.CharField(max_length=100, unique=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('nodes', models.ManyToManyField(blank=True, to='partner.Node')),
+            ],
+        ),
+    ]
@@ -14,20 +14,32 @@
 
 from __future__ import unicode_literals
 
-from django.db import models
+from datetime import timedelta
+from django.db import models, transaction
 from django import forms
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+import base64
 import collections
-import datetime
+import hashlib
+import json
+import logging
 import random
-import time
 
+from client import settings
+from logarchive import LogArchive
 from multipleselection.models import MultipleSelectionField
 from project import utils
 from projectdata.settings import DataManager
+import partner.gearadmin
+import partner.models
 import partner.utils
 
 
+logger = logging.getLogger(__name__)
+
+
 def _vessel(data):
     if isinstance(data, list):
         return []
@@ -79,22 +91,26 @@ class Project(models.Model):
     name = models.CharField(max_length=100,
                             unique=True)
     nodes = MultipleSelectionField(max_length=150, choices=NODE_CHOICES)
-    builds = None
-    lastBuildRefresh = None
+    # Hash of the last job definition generated, see updateDefinitions.
+    definitionHash = models.CharField(max_length=64, blank=True, default='')
 
     def lastBuild(self):
-        self._refreshBuildInformation()
+        """Return the most recent recorded Build or None if never built."""
         try:
-            lastStatus = self.builds[0]['result']
-        except IndexError:
-            lastStatus = None
-        return lastStatus
+            return self._lastBuild
+        except AttributeError:
+            self._lastBuild = self.build_set.select_related('node').first()
+            return self._lastBuild
 
-    def builds(self):
-        self._refreshBuildInformation()
-        return self.builds
+    def getData(self, dataList=None):
+        """Return the project job definition, as Jenkins Job Builder data.
 
-    def getData(self):
+        Args:
+            dataList (list): The project Data, as loaded by
+                Data.loadChildren. Loaded from database when None.
+        """
+        if dataList is None:
+            dataList = Data.loadChildren([self]).get(self.id, [])
         dataRepresentation = {
             'job': {
                 'name': self.name,
@@ -102,7 +118,7 @@ class Project(models.Model):
                 'node': str(' || '.join(self.nodes))
             }
         }
-        for data in self.data_set.all():
+        for data in dataList:
             info = data.getData()
             parent = dataRepresentation
             # Find insertion point.
@@ -116,28 +132,99 @@ class Project(models.Model):
         # Convert all data to basestring.
         return [_convert(dataRepresentation)]
 
-    def _refreshBuildInformation(self):
-        if self.lastBuildRefresh is None or \
-                (datetime.datetime.today() -
-                 self.lastBuildRefresh).seconds >= 4:
-            self.builds = partner.utils.getBuildInformation(self.name)
-            self.lastBuildRefresh = datetime.datetime.today()
+    @staticmethod
+    def getBulkData(projects):
+        """Map each project id to its job definition (see getData).
+
+        The Data of every project is loaded at once with Data.loadChildren.
+        """
+        children = Data.loadChildren(projects)
+        return {p.id: p.getData(children.get(p.id, [])) for p in projects}
+
+    @staticmethod
+    def hashDefinition(definition):
+        """Return the SHA-256 hex digest of a canonical job definition."""
+        canonical = json.dumps(definition, sort_keys=True,
+                               separators=(',', ':'))
+        return hashlib.sha256(canonical).hexdigest()
+
+    @staticmethod
+    def updateDefinitions(projects):
+        """Generate the projects job definitions and store their hashes.
+
+        Returns:
+            dict: Project ids mapped to their job definition.
+        """
+        definitions = Project.getBulkData(projects)
+        for project in projects:
+            definitionHash = Project.hashDefinition(definitions[project.id])
+            if definitionHash != project.definitionHash:
+                project.definitionHash = definitionHash
+                project.save(update_fields=['definitionHash'])
+        return definitions
 
     def triggerBuild(self):
-        gclient = utils.getGearClientConnection()
+        """Request a build of the project.
+
+        With BUILD_TRACKING, the build is queued for the trackbuilds
+        command, which submits it and records it as it runs (see
+        buildtracker.py). Otherwise it is submitted at once as a background
+        job, and recorded by the build poller.
+        """
+        if settings.BUILD_TRACKING:
+            BuildRequest.objects.create(project=self)
+            return
+        utils.getGearClient().submitJobs(self.buildJobs())
 
+    def buildJobs(self):
+        """Return the Gearman jobs building the project on its nodes."""
         if len(self.nodes) == 0 or \
                 (len(self.nodes) == 1 and self.nodes[0] == 'any'):
-            job = utils.gearJobFactory('build', self.name)
-            time.sleep(random.uniform(0.05, 0.2))
-            gclient.submitJob(job, True)
-        else:
-            for node in self.nodes:
-                job = utils.gearJobFactory('build', self.name, node)
-                time.sleep(random.uniform(0.05, 0.2))
-                gclient.submitJob(job, True)
+            label = self._leastLoadedLabel() \
+                if settings.GEARMAN_LABEL_ROUTING else None
+            return [utils.gearJobFactory('build', self.name, label)]
+        return [utils.gearJobFactory('build', self.name, node)
+                for node in self.nodes]
+
+    def _leastLoadedLabel(self):
+        """Return the node label where a build would wait the least.
+
+        The expected wait of a label is the amount of builds of all projects
+        queued or running on it per worker of the label, as reported by the
+        Gearman server. Only labels with workers for the project are
+        considered, and ties are broken randomly. Returns None when no label
+        has workers or the server state is unknown, so any worker may take
+        the build.
+        """
+        registry = partner.gearadmin.GearmanRegistry.get()
+        try:
+            state = registry.current()
+        except Exception:
+            logger.exception('Failed to get the Gearman server state')
+            return None
 
-        gclient.shutdown()
+        candidates = []
+        bestWait = None
+        for label, description in self.NODE_CHOICES:
+            if label == 'any':
+                continue
+            function = state.function('build:%s:%s' % (self.name, label))
+            if function is None or function.workers == 0:
+                continue
+            builds, workers = state.labelLoad(label)
+            wait = builds / float(max(workers, function.workers))
+            if bestWait is None or wait < bestWait:
+                candidates = [function]
+                bestWait = wait
+            elif wait == bestWait:
+                candidates.append(function)
+
+        if not candidates:
+            return None
+        best = random.choice(candidates)
+        # Following builds are routed before the state is fetched again.
+        registry.recordQueued(best.name)
+        return best.name.rsplit(':', 1)[1]
 
     @staticmethod
     def getForms(projType):
@@ -165,3 +252,440 @@ class Data(models.Model):
 
     def getData(self):
         return getattr(self, self.type).getData()
+
+    @staticmethod
+    def childModels():
+        """Map each Data type to its multi-table inheritance child model."""
+        return {rel.get_accessor_name(): rel.related_model
+                for rel in Data._meta.related_objects
+                if rel.one_to_one and rel.parent_link}
+
+    @staticmethod
+    def loadChildren(projects):
+        """Load the Data of many projects as instances of their child models.
+
+        Resolving the child of each Data row through getattr costs a query
+        per row. Rows are instead grouped by type and each child model is
+        queried once, so loading takes one query plus one per type.
+
+        Returns:
+            dict: Project ids mapped to the list of their child Data, in
+                creation order.
+        """
+        rows = Data.objects.filter(parent__in=projects).order_by('id') \
+            .values_list('id', 'type', 'parent_id')
+
+        idsByType = collections.defaultdict(list)
+        for dataId, dataType, parentId in rows:
+            idsByType[dataType].append(dataId)
+
+        childModels = Data.childModels()
+        children = {}
+        for dataType, ids in idsByType.items():
+            for child in childModels[dataType].objects.filter(pk__in=ids):
+                children[child.pk] = child
+
+        dataByProject = collections.defaultdict(list)
+        for dataId, dataType, parentId in rows:
+            dataByProject[parentId].append(children[dataId])
+        return dataByProject
+
+
+class JobDeployment(models.Model):
+    """Models the job definition last uploaded to a node for a project.
+
+    The error of the last failed upload, if any, is kept along with it.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    node = models.ForeignKey(partner.models.Node, on_delete=models.CASCADE)
+    hash = models.CharField(max_length=64, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('project', 'node')
+
+    @staticmethod
+    def outdated(node, projects):
+        """Return the projects whose current job definition is not on node."""
+        applied = dict(JobDeployment.objects
+                       .filter(node=node, project__in=projects)
+                       .values_list('project_id', 'hash'))
+        return [p for p in projects
+                if applied.get(p.id) != p.definitionHash]
+
+    @staticmethod
+    def recordSuccess(project, node):
+        JobDeployment.objects.update_or_create(
+            project=project, node=node,
+            defaults={'hash': project.definitionHash, 'error': ''})
+
+    @staticmethod
+    def recordFailure(project, node, error):
+        JobDeployment.objects.update_or_create(
+            project=project, node=node, defaults={'error': str(error)})
+
+    @staticmethod
+    def publishStatus(project):
+        """Return the publish state of a project job on each active node.
+
+        Nodes not registered yet are left out. Nodes offline are reported
+        'offline' until they are back online and get the job.
+
+        Returns:
+            list: Dicts with the node id, host, port, state ('pending',
+                'applied', 'failed' or 'offline') and error of the last
+                failure.
+        """
+        deployments = {d.node_id: d for d in
+                       JobDeployment.objects.filter(project=project)}
+        nodes = partner.models.Node.objects.filter(site__active=True) \
+            .exclude(host='0.0.0.0').select_related('health').order_by('id')
+
+        status = []
+        for node in nodes:
+            deployment = deployments.get(node.id)
+            error = ''
+            if deployment is None:
+                state = 'pending'
+            elif project.definitionHash and \
+                    deployment.hash == project.definitionHash:
+                state = 'applied'
+            elif deployment.error:
+                state = 'failed'
+                error = deployment.error
+            else:
+                state = 'pending'
+            if state == 'pending' and node.status() != 'online':
+                state = 'offline'
+            status.append({'node': node.id, 'host': node.host,
+                           'port': node.port, 'state': state,
+                           'error': error})
+        return status
+
+
+class SyncRequest(models.Model):
+    """Models a pending synchronization of a project job with the nodes.
+
+    This is the outbox drained by the syncworker command. Requests are keyed
+    by job name, so further changes to a project made before its request is
+    applied merge into it. Requests are due PROJECT_SYNC_WINDOW seconds
+    after their last change, which lets close changes merge.
+    """
+    UPDATE = 'update'
+    ACTIONS = (
+        (UPDATE, 'Update'),
+    )
+
+    jobName = models.CharField(max_length=100, unique=True)
+    project = models.ForeignKey(Project, null=True,
+                                on_delete=models.SET_NULL)
+    action = models.CharField(max_length=10, choices=ACTIONS,
+                              default=UPDATE)
+    # Bumped on every merge, so a request changed while being applied is
+    # not taken as done.
+    version = models.IntegerField(default=0)
+    due = models.DateTimeField(db_index=True)
+    attempts = models.IntegerField(default=0)
+    lastError = models.TextField(blank=True, default='')
+
+    @staticmethod
+    def enqueue(project, action=UPDATE):
+        """Queue the synchronization of a project job, merging if pending."""
+        due = timezone.now() + timedelta(seconds=settings.PROJECT_SYNC_WINDOW)
+        with transaction.atomic():
+            request, created = SyncRequest.objects.get_or_create(
+                jobName=project.name,
+                defaults={'project': project, 'action': action, 'due': due})
+            if not created:
+                # The merged change is new, so it gets its own window and
+                # a fresh retry count.
+                SyncRequest.objects.filter(id=request.id).update(
+                    project=project, action=action, due=due, attempts=0,
+                    version=models.F('version') + 1)
+        return request
+
+    @staticmethod
+    def pending(limit=None):
+        """Return the requests due, oldest first."""
+        requests = SyncRequest.objects.filter(due__lte=timezone.now()) \
+            .select_related('project').order_by('due')
+        return list(requests[:limit] if limit else requests)
+
+    def complete(self):
+        """Remove the request, unless it changed since it was read."""
+        SyncRequest.objects.filter(id=self.id, version=self.version).delete()
+
+    def retry(self, error):
+        """Postpone the request with exponential backoff."""
+        delay = min(settings.PROJECT_SYNC_RETRY_DELAY * 2 ** self.attempts,
+                    settings.PROJECT_SYNC_MAX_BACKOFF)
+        SyncRequest.objects.filter(id=self.id).update(
+            attempts=models.F('attempts') + 1,
+            due=timezone.now() + timedelta(seconds=delay),
+            lastError=str(error))
+
+
+class BuildRequest(models.Model):
+    """Models a build requested from the web, to be submitted to Gearman.
+
+    This is the outbox drained by the trackbuilds command. Builds are
+    submitted as foreground jobs from that long-lived process, so they are
+    not dropped when a uwsgi worker is recycled.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @staticmethod
+    def pending():
+        """Return the requests, oldest first."""
+        return list(BuildRequest.objects.select_related('project')
+                    .order_by('created'))
+
+
+class JobTombstone(models.Model):
+    """Models the job of a deleted project, to be removed from the nodes.
+
+    Jobs are removed by the syncworker command from the nodes online, and
+    from the others once they are back online. A tombstone is kept until
+    every active node removed the job, or for PROJECT_TOMBSTONE_TTL seconds
+    at most.
+
+    A project created with the name of a deleted one does not cancel the
+    tombstone: its job is only uploaded to the nodes that removed the old
+    one (see buriedOn), so it never inherits the old builds. The tombstone
+    is then kept past PROJECT_TOMBSTONE_TTL, until every node removed the
+    old job.
+    """
+    jobName = models.CharField(max_length=100, unique=True)
+    created = models.DateTimeField(default=timezone.now)
+    # Nodes the job was removed from.
+    nodes = models.ManyToManyField(partner.models.Node, blank=True)
+
+    @staticmethod
+    def bury(project):
+        """Delete a project and record its job for removal from the nodes."""
+        with transaction.atomic():
+            tombstone, created = JobTombstone.objects.get_or_create(
+                jobName=project.name)
+            if not created:
+                tombstone.created = timezone.now()
+                tombstone.save(update_fields=['created'])
+                tombstone.nodes.clear()
+            SyncRequest.objects.filter(jobName=project.name).delete()
+            projectId = project.id
+            project.delete()
+        LogArchive.get().purge(projectId)
+        return tombstone
+
+    @staticmethod
+    def pending(nodes):
+        """Map the nodes ids to the tombstones they did not apply yet."""
+        tombstones = list(JobTombstone.objects.prefetch_related('nodes'))
+        pending = {}
+        for node in nodes:
+            jobs = [t for t in tombstones
+                    if node.id not in {n.id for n in t.nodes.all()}]
+            if jobs:
+                pending[node.id] = jobs
+        return pending
+
+    @staticmethod
+    def buriedOn(node):
+        """Return the names of the jobs node did not remove yet."""
+        return set(JobTombstone.objects.exclude(nodes=node)
+                   .values_list('jobName', flat=True))
+
+    @staticmethod
+    def prune():
+        """Remove the tombstones applied by every node or too old.
+
+        Nodes not registered yet are left out, as they have no job to
+        remove.
+        """
+        expiration = timezone.now() - \
+            timedelta(seconds=settings.PROJECT_TOMBSTONE_TTL)
+        JobTombstone.objects.filter(created__lt=expiration) \
+            .exclude(jobName__in=Project.objects.values('name')).delete()
+
+        nodeIds = set(partner.models.Node.objects.filter(site__active=True)
+                      .exclude(host='0.0.0.0').values_list('id', flat=True))
+        for tombstone in JobTombstone.objects.prefetch_related('nodes'):
+            if nodeIds <= {n.id for n in tombstone.nodes.all()}:
+                tombstone.delete()
+
+
+class Build(models.Model):
+    """Models a build of a project job run by a partner node.
+
+    Builds are recorded as they run from the Gearman packets of the builds
+    triggered here (see buildtracker.py) and by the build poller (see
+    buildpoller.py), so views never have to reach the partner nodes to
+    show a project history.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    node = models.ForeignKey(partner.models.Node, on_delete=models.CASCADE)
+    number = models.IntegerField()
+    result = models.CharField(max_length=20, null=True)
+    timestamp = models.DateTimeField()
+    duration = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-timestamp']
+        unique_together = ('project', 'node', 'number')
+        index_together = [('project', 'timestamp')]
+
+    @property
+    def name(self):
+        return 'jenkins' + str(self.node_id) + 'build' + str(self.number)
+
+    def consoleOutput(self, start=0, limit=None):
+        """Read part of the build console output.
+
+        The output is read from the local log archive when the build has
+        been archived and from the node that ran it otherwise.
+
+        Returns:
+            tuple: (text, next start offset, True if there is more text).
+        """
+        archive = LogArchive.get()
+        if archive.exists(self.project_id, self.node_id, self.number):
+            return archive.readBytes(self.project_id, self.node_id,
+                                     self.number, start, limit)
+
+        jconn = self.node.connect()
+        try:
+            return partner.utils.getConsoleText(jconn, self.project.name,
+                                                self.number, start, limit)
+        finally:
+            self.node.disconnect()
+
+    def consoleLines(self, start=0, count=None):
+        """Read a line range of the archived build console output.
+
+        Returns:
+            tuple: (list of lines, total amount of lines), or None when the
+                build console output is not archived.
+        """
+        archive = LogArchive.get()
+        if not archive.exists(self.project_id, self.node_id, self.number):
+            return None
+        return archive.readLines(self.project_id, self.node_id,
+                                 self.number, start, count)
+
+    @staticmethod
+    def lastSyncedNumber(project, node):
+        """Return the highest build number that needs no further polling.
+
+        Builds still running (result is None) are polled again until they
+        finish, so the number right before the oldest running one is
+        returned when there is any.
+        """
+        builds = Build.objects.filter(project=project, node=node)
+        running = builds.filter(result__isnull=True) \
+            .aggregate(models.Min('number'))['number__min']
+        if running is not None:
+            return running - 1
+        return builds.aggregate(models.Max('number'))['number__max'] or 0
+
+    @staticmethod
+    def timeline(project, cursor=None, size=None):
+        """Return a page of the project builds, newest first.
+
+        Pages are read past the cursor using the (project, timestamp) index,
+        so any page costs the same whatever the amount of builds.
+
+        Args:
+            project (Project): Project the builds belong to.
+            cursor (str): Opaque cursor returned along with the previous
+                page. None starts from the newest build.
+            size (int): Amount of builds per page. Defaults to
+                settings.BUILD_HISTORY_PAGE_SIZE.
+
+        Returns:
+            tuple: (list of Builds, cursor of the next page or None if this
+                is the last page).
+
+        Raises:
+            ValueError: When the cursor is not valid.
+        """
+        if size is None:
+            size = settings.BUILD_HISTORY_PAGE_SIZE
+        builds = Build.objects.filter(project=project) \
+            .select_related('node').order_by('-timestamp', '-id')
+        if cursor is not None:
+            timestamp, buildId = Build._decodeCursor(cursor)
+            builds = builds.filter(
+                models.Q(timestamp__lt=timestamp) |
+                models.Q(timestamp=timestamp, id__lt=buildId))
+
+        page = list(builds[:size + 1])
+        if len(page) <= size:
+            return page, None
+        page = page[:size]
+        return page, Build._encodeCursor(page[-1])
+
+    @staticmethod
+    def _encodeCursor(build):
+        position = '%s|%d' % (build.timestamp.isoformat(), build.id)
+        return base64.urlsafe_b64encode(position.encode('ascii'))
+
+    @staticmethod
+    def _decodeCursor(cursor):
+        try:
+            timestamp, buildId = base64.urlsafe_b64decode(str(cursor)) \
+                .split('|')
+            timestamp = parse_datetime(timestamp)
+            buildId = int(buildId)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid build timeline cursor: %r' % cursor)
+        if timestamp is None:
+            raise ValueError('Invalid build timeline cursor: %r' % cursor)
+        return timestamp, buildId
+
+    @staticmethod
+    def lastBuilds(projects):
+        """Map each project id to its most recent Build in one query."""
+        table = Build._meta.db_table
+        builds = Build.objects.filter(project__in=projects).extra(where=[
+            '%(t)s.timestamp = (SELECT MAX(b.timestamp) FROM %(t)s b '
+            'WHERE b.project_id = %(t)s.project_id)' % {'t': table}
+        ]).select_related('node')
+        return {b.project_id: b for b in builds}
+
+    @staticmethod
+    def statuses(projects):
+        """Map the projects names to the status of their last build."""
+        lastBuilds = Build.lastBuilds(projects)
+
+        statuses = {}
+        for project in projects:
+            build = lastBuilds.get(project.id)
+            if build is None:
+                statuses[project.name] = None
+            else:
+                statuses[project.name] = {
+                    'number': build.number,
+                    'node': build.node_id,
+                    'result': build.result,
+                    'building': build.result is None,
+                    'timestamp': build.timestamp.isoformat(),
+                }
+        return statuses
+
+    @staticmethod
+    def statusVersion(projects=None):
+        """Return a tag that changes whenever a build starts or finishes.
+
+        New builds raise the highest build id and finished builds the
+        amount of builds with a result, so a single aggregate query tells
+        whether the statuses may have changed, without computing them.
+
+        Args:
+            projects: Projects whose builds are considered. Defaults to all.
+        """
+        builds = Build.objects.all() if projects is None \
+            else Build.objects.filter(project__in=projects)
+        counts = builds.aggregate(last=models.Max('id'),
+                                  finished=models.Count('result'))
+        return '%d-%d' % (counts['last'] or 0, counts['finished'])
@@ -0,0 +1,173 @@
+# Copyright IBM Corp, 2016
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied. See the License for the specific language governing
+# permissions and limitations under the License.
+
+
+"""Server-sent events of the projects build statuses, served out of uwsgi.
+
+A held connection would keep one of the few prefork uwsgi workers busy, so
+the status events are served by the statusevents command instead, with a
+thread per connection, behind nginx. A single BuildWatcher checks every
+STATUS_STREAM_INTERVAL seconds whether any build started or finished (see
+models.Build.statusVersion). Only then do the connections compute the
+statuses of their user, and send the ones that changed.
+"""
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from Cookie import CookieError, SimpleCookie
+from SocketServer import ThreadingMixIn
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core import urlresolvers
+from django.db import connection
+from importlib import import_module
+import logging
+import simplejson
+import socket
+import threading
+import time
+
+import models
+
+
+logger = logging.getLogger(__name__)
+
+
+class BuildWatcher(threading.Thread):
+    """Tells the waiting connections when the builds status version moves."""
+
+    def __init__(self):
+        super(BuildWatcher, self).__init__()
+        self.daemon = True
+        self.version = None
+        self.changed = threading.Condition()
+
+    def run(self):
+        while True:
+            try:
+                version = models.Build.statusVersion()
+            except Exception:
+                logger.exception('Failed to check the builds status version')
+                connection.close()
+                version = self.version
+            with self.changed:
+                if version != self.version:
+                    self.version = version
+                    self.changed.notify_all()
+            time.sleep(settings.STATUS_STREAM_INTERVAL)
+
+    def wait(self, version, timeout):
+        """Wait up to timeout seconds for the version to differ from version.
+
+        Returns:
+            The current version.
+        """
+        with self.changed:
+            if self.version == version:
+                self.changed.wait(timeout)
+            return self.version
+
+
+class _SessionRequest(object):
+    """The part of a Django request get_user needs."""
+
+    def __init__(self, session):
+        self.session = session
+
+
+class StatusEventsHandler(BaseHTTPRequestHandler):
+    """Streams the status changes of the projects of the session user.
+
+    Events hold JSON objects formatted as the status view ones, and their
+    id is the status version of the user builds. Browsers send the id of
+    the last event received when they reconnect, so unchanged statuses are
+    not sent again.
+    """
+
+    def do_GET(self):
+        try:
+            if self.path.split('?')[0] != \
+                    urlresolvers.reverse('project:status_events'):
+                self.send_error(404)
+                return
+            user = self._user()
+            if not user.is_authenticated():
+                self.send_error(403)
+                return
+            self._stream(user)
+        except socket.error:
+            # The client went away.
+            pass
+        finally:
+            connection.close()
+
+    def _user(self):
+        cookie = SimpleCookie()
+        try:
+            cookie.load(self.headers.getheader('Cookie') or '')
+        except CookieError:
+            pass
+        morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+        engine = import_module(settings.SESSION_ENGINE)
+        session = engine.SessionStore(morsel and morsel.value)
+        return get_user(_SessionRequest(session))
+
+    def _send(self, text):
+        self.wfile.write(text)
+        self.wfile.flush()
+
+    def _stream(self, user):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self._send('retry: %d\n\n' % (settings.STATUS_STREAM_INTERVAL * 1000))
+
+        sentVersion = self.headers.getheader('Last-Event-ID')
+        sent = None
+        watched = None
+        while True:
+            projects = list(user.project_set.all())
+            version = models.Build.statusVersion(projects)
+            if version != sentVersion:
+                statuses = models.Build.statuses(projects)
+                changed = statuses if sent is None else \
+                    {name: status for name, status in statuses.items()
+                     if name not in sent or sent[name] != status}
+                if changed:
+                    self._send('id: %s\ndata: %s\n\n'
+                               % (version, simplejson.dumps(changed)))
+                sent = statuses
+                sentVersion = version
+
+            previous = watched
+            watched = self.server.watcher.wait(
+                watched, settings.STATUS_EVENTS_KEEPALIVE)
+            if watched == previous:
+                # Comments keep proxies from closing idle streams.
+                self._send(': keepalive\n\n')
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class StatusEventsServer(ThreadingMixIn, HTTPServer):
+    """Serves status events on STATUS_EVENTS_PORT of the loopback."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', settings.STATUS_EVENTS_PORT),
+                            StatusEventsHandler)
+        self.watcher = BuildWatcher()
+        self.watcher.start()
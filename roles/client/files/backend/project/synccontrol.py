@@ -14,38 +14,160 @@
 
 from django.conf import settings
 from jenkins_jobs.builder import Builder as JenkinsJobBuilder
-from tempfile import TemporaryFile
-import datetime
-# import random
-import threading
-# import time
+import io
+import logging
+import time
 import yaml
 
 import models
 import partner
 
 
-class SyncProjectsThread(threading.Thread):
+logger = logging.getLogger(__name__)
+
+
+def deployJobs(node, user, password, projects, definitions):
+    """Upload to a node the job definitions it does not have yet.
+
+    Projects whose definition hash matches the one last applied on the node
+    are skipped (see models.JobDeployment). Projects named as a deleted
+    project whose job the node did not remove yet (see models.JobTombstone)
+    fail, so they never take over the old job and its builds. The others
+    are written to a single in-memory YAML stream, parsed and expanded by
+    Jenkins Job Builder in one pass, then uploaded job by job over the same
+    connection.
+
+    Args:
+        node (Node): Node to upload the jobs to.
+        user (str): Jenkins user name.
+        password (str): Jenkins user password.
+        projects (list): Projects to deploy, with up to date hashes.
+        definitions (dict): Project ids mapped to their job definition, as
+            returned by Project.updateDefinitions.
+
+    Returns:
+        dict: Projects uploaded mapped to None, or to the error raised when
+            uploading their job.
+    """
+    results = {}
+    buried = models.JobTombstone.buriedOn(node)
+    outdated = []
+    for project in models.JobDeployment.outdated(node, projects):
+        if project.name in buried:
+            error = 'The job of a deleted project %s is not removed yet' \
+                % project.name
+            models.JobDeployment.recordFailure(project, node, error)
+            results[project] = error
+        else:
+            outdated.append(project)
+    if not outdated:
+        return results
+
+    jenkinsUrl = partner.utils.JENKINS_URL \
+        % {'host': node.host, 'port': node.port}
+    builder = JenkinsJobBuilder(jenkinsUrl, user, password,
+                                ignore_cache=True)
+
+    jobs = []
+    for project in outdated:
+        jobs.extend(definitions[project.id])
+    builder.load_files([io.BytesIO(yaml.dump(jobs))])
+    builder.parser.expandYaml()
+    builder.parser.generateXML()
+    xmlJobs = {job.name: job for job in builder.parser.xml_jobs}
+
+    for project in outdated:
+        try:
+            job = xmlJobs[project.name]
+            builder.jenkins.update_job(job.name,
+                                       job.output().decode('utf-8'))
+        except Exception as e:
+            logger.warning('Failed to upload job %s to node %s:%s: %s',
+                           project.name, node.host, node.port, e)
+            models.JobDeployment.recordFailure(project, node, e)
+            results[project] = e
+            continue
+
+        models.JobDeployment.recordSuccess(project, node)
+        results[project] = None
+    return results
+
+
+def buryJobs(node, jconn, tombstones):
+    """Remove from a node the jobs of deleted projects.
+
+    Args:
+        node (Node): Node to remove the jobs from.
+        jconn (Jenkins): Connection to the node.
+        tombstones (list): JobTombstone instances the node did not apply.
+
+    Returns:
+        int: The amount of jobs removed.
+    """
+    removed = 0
+    for tombstone in tombstones:
+        try:
+            if jconn.job_exists(tombstone.jobName):
+                jconn.delete_job(tombstone.jobName)
+                removed += 1
+        except Exception as e:
+            logger.warning('Failed to delete job %s from node %s:%s: %s',
+                           tombstone.jobName, node.host, node.port, e)
+            continue
+        tombstone.nodes.add(node)
+    return removed
+
+
+class ProjectSync(object):
+    """Synchronizes the projects jobs with every online node at once.
+
+    Each node is synchronized on its own in the shared node pool, from its
+    own copy of the projects to sync. The outcome for each node is kept in
+    synced (node id mapped to the amount of jobs uploaded) and failed (node
+    id mapped to the error, or to the errors of the jobs that failed).
+    """
 
     def __init__(self, newProjects):
-        super(SyncProjectsThread, self).__init__()
         self.jobs = [str(j.name) for j in models.Project.objects.all()]
-        self.newProjects = set(newProjects)
+        self.newProjects = list(set(newProjects))
+        self.synced = {}
+        self.failed = {}
 
     def run(self):
         nodes = partner.utils.getOnlineNodes()
+        self.jobDefinitions = models.Project.updateDefinitions(
+            self.newProjects)
 
-        if settings.REMOVE_DANGLING_PROJECTS:
-            for node in nodes:
-                jconn = node.connect()
-                self._syncRemovedProjects(jconn)
-                self._syncNewProjects(node)
-                node.disconnect()
-        else:
-            for node in nodes:
-                jconn = node.connect()
-                self._syncNewProjects(node)
+        for node, uploaded in partner.utils.mapNodes(
+                self._syncNode, nodes, settings.PROJECT_SYNC_TIMEOUT):
+            self.synced[node.id] = uploaded
+
+        for node in nodes:
+            if node.id not in self.synced and node.id not in self.failed:
+                self.failed[node.id] = 'timeout'
+        if self.failed:
+            logger.warning('Failed to sync projects with nodes: %s',
+                           self.failed)
+
+    def _syncNode(self, node):
+        try:
+            jconn = node.connect()
+            try:
+                if settings.REMOVE_DANGLING_PROJECTS:
+                    self._syncRemovedProjects(jconn)
+                results = self._syncNewProjects(node, list(self.newProjects))
+            finally:
                 node.disconnect()
+        except Exception as e:
+            self.failed[node.id] = e
+            for project in self.newProjects:
+                models.JobDeployment.recordFailure(project, node, e)
+            raise
+
+        errors = {p.name: e for p, e in results.items() if e is not None}
+        if errors:
+            self.failed[node.id] = errors
+        return len(results) - len(errors)
 
     def _syncRemovedProjects(self, jconn):
         nodeJobs = [str(job['name']) for job in jconn.get_jobs()]
@@ -54,56 +176,91 @@ class SyncProjectsThread(threading.Thread):
             if nodeJob not in self.jobs:
                 jconn.delete_job(nodeJob)
 
-    def _syncNewProjects(self, node):
-        jenkinsUrl = partner.utils.JENKINS_URL \
-                     % {'host': node.host, 'port': node.port}
+    def _syncNewProjects(self, node, projects):
+        return deployJobs(node, node.conn['user'], node.conn['passwd'],
+                          projects, self.jobDefinitions)
 
-        builder = JenkinsJobBuilder(jenkinsUrl,
-                                    node.conn['user'],
-                                    node.conn['passwd'],
-                                    ignore_cache=True)
 
-        while self.newProjects:
-            project = self.newProjects.pop()
+class SyncWorker(object):
+    """Drains the sync outbox (see models.SyncRequest).
 
-            tempFile = TemporaryFile()
-            tempFile.write(yaml.dump(project.getData()))
-            tempFile.seek(0)
+    Due requests are applied in batches of PROJECT_SYNC_BATCH_SIZE. A batch
+    is done once every online node applied it, and retried with backoff
+    otherwise. Applying is idempotent as nodes are only sent the jobs they
+    do not have yet. The jobs of deleted projects are removed from the
+    nodes on every drain (see models.JobTombstone). Every
+    PROJECT_RECONCILE_INTERVAL seconds all projects are synchronized, which
+    catches up nodes that were offline.
+    """
 
-            builder.update_jobs(tempFile)
-            tempFile.close()
+    def __init__(self):
+        self.lastReconcile = 0
 
+    def drain(self):
+        """Apply the requests due and reconcile when it is time to.
 
-class SyncControl(object):
+        Returns:
+            int: The amount of requests applied.
+        """
+        try:
+            self.bury()
+        except Exception:
+            logger.exception('Failed to delete the jobs of deleted projects')
 
-    DEFAULT_PROJECT_SYNC_INTERVAL = 60  # 1 minute
-    _instance = None
+        if time.time() - self.lastReconcile >= \
+                settings.PROJECT_RECONCILE_INTERVAL:
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception('Failed to reconcile the projects')
 
-    def __init__(self):
-        self.newProjects = []
-        self.lastSync = datetime.datetime(1991, 10, 12, 3, 20)
-        self.syncInterval = SyncControl.DEFAULT_PROJECT_SYNC_INTERVAL
+        requests = models.SyncRequest.pending(
+            settings.PROJECT_SYNC_BATCH_SIZE)
+        if not requests:
+            return 0
+
+        projects = [r.project for r in requests if r.project is not None]
+        sync = ProjectSync(projects)
+        try:
+            sync.run()
+        except Exception as e:
+            sync.failed['all'] = e
 
-    def isTimeToSync(self):
-        return (datetime.datetime.today() - self.lastSync).seconds > \
-            self.syncInterval
+        if sync.failed:
+            for request in requests:
+                request.retry(sync.failed)
+            return 0
 
-    def syncRemovedProjects(self, newProject):
-        if newProject is not None:
-            self.newProjects.append(newProject)
+        for request in requests:
+            request.complete()
+        return len(requests)
 
-        if not self.isTimeToSync():
-            return
+    def bury(self):
+        """Remove the jobs of deleted projects from the online nodes.
 
-        self.lastSync = datetime.datetime.today()
+        Each node is only sent the tombstones it did not apply yet, so nodes
+        back online catch up on the projects deleted meanwhile.
+        """
+        nodes = partner.utils.getOnlineNodes()
+        pending = models.JobTombstone.pending(nodes)
+
+        def buryNode(node):
+            jconn = node.connect()
+            try:
+                return buryJobs(node, jconn, pending[node.id])
+            finally:
+                node.disconnect()
 
-        syncThread = SyncProjectsThread(self.newProjects)
-        syncThread.start()
+        for node, removed in partner.utils.mapNodes(
+                buryNode, [n for n in nodes if n.id in pending],
+                settings.PROJECT_SYNC_TIMEOUT):
+            if removed:
+                logger.info('Deleted %d jobs from node %s:%s', removed,
+                            node.host, node.port)
+        models.JobTombstone.prune()
 
-    @classmethod
-    def sync(cls, projectToSync=None):
-        try:
-            cls._instance.syncRemovedProjects(projectToSync)
-        except:
-            cls._instance = cls()
-            cls._instance.syncRemovedProjects(projectToSync)
+    def reconcile(self):
+        # Failed reconciliations wait for the next interval too.
+        self.lastReconcile = time.time()
+        sync = ProjectSync(models.Project.objects.all())
+        sync.run()
@@ -22,6 +22,16 @@ urlpatterns = [
     url(r'^create$', views.selectProjectType, name='select_project_type'),
     url(r'^create/(?P<projType>.+)$', views.create, name='create'),
     url(r'^update$', views.update, name='update'),
+    url(r'^status\.json$', views.status, name='status'),
+    url(r'^status/events$', views.statusEvents, name='status_events'),
+    url(r'^(?P<projName>[^/]+)/publish\.json$', views.publishStatus,
+        name='publish_status'),
+    url(r'^(?P<projName>[^/]+)/builds$', views.buildHistory,
+        name='build_history'),
+    url(r'^(?P<projName>[^/]+)/build/(?P<nodeId>[0-9]+)/(?P<number>[0-9]+)'
+        r'/console$', views.consoleOutput, name='console'),
+    url(r'^(?P<projName>[^/]+)/build/(?P<nodeId>[0-9]+)/(?P<number>[0-9]+)'
+        r'/console/stream$', views.streamConsoleOutput, name='console_stream'),
     url(r'^(?P<projName>.+)/delete$', views.delete, name='delete'),
     url(r'^(?P<projName>.+)/build$', views.buildProject, name='build'),
     url(r'^(?P<projName>.+)/abort$', views.abortBuild, name='abort'),
@@ -13,18 +13,239 @@
 # permissions and limitations under the License.
 
 # Utils methods for project management
+import errno
+import fcntl
 import gear
+import os
 import simplejson
+import threading
+import time
 import uuid
 
 from client import settings
 
 
-def getGearClientConnection():
-    gclient = gear.Client()
-    gclient.addServer(settings.GEARMAN_HOST)
-    gclient.waitForServer()
-    return gclient
+_gearClient = None
+_gearClientLock = threading.Lock()
+
+
+class GearClient(gear.Client):
+    """Gearman client kept connected for the whole process life.
+
+    gear reconnects lost servers in background. Connections idle for more
+    than GEARMAN_CHECK_INTERVAL seconds are checked with an echo before
+    being used, so servers that silently dropped them are detected before
+    jobs are lost. Submissions are serialized as gear matches the server
+    answers to the jobs by the order they were sent on a connection.
+
+    Callables added to jobListeners are called from the client polling
+    thread as listener(job, event, data) when a submitted job reports data
+    ('data'), progress ('status'), its end ('complete', 'fail' or
+    'exception') or is lost along with its server ('disconnect').
+    """
+
+    def __init__(self):
+        super(GearClient, self).__init__(client_id='client-%d' % os.getpid())
+        self.submitLock = threading.Lock()
+        self.lastChecked = {}
+        self.echoes = {}
+        self.jobListeners = []
+        self.addServer(settings.GEARMAN_HOST, settings.GEARMAN_PORT)
+
+    def _waitForConnection(self, deadline):
+        self.connections_condition.acquire()
+        try:
+            while not self.active_connections:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise gear.NoConnectedServersError(
+                        'No connected Gearman servers')
+                self.connections_condition.wait(remaining)
+        finally:
+            self.connections_condition.release()
+
+    def _checkedConnection(self):
+        deadline = time.time() + settings.GEARMAN_TIMEOUT
+        while True:
+            self._waitForConnection(deadline)
+            conn = self.getConnection()
+            if time.time() - self.lastChecked.get(conn, 0) < \
+                    settings.GEARMAN_CHECK_INTERVAL:
+                return conn
+            if self._echo(conn, max(deadline - time.time(), 0.1)):
+                self.lastChecked[conn] = time.time()
+                return conn
+            self.log.warning('Dropping unresponsive connection %s', conn)
+            self._lostConnection(conn)
+
+    def _echo(self, conn, timeout):
+        # gear.Connection.echo is not answered on client connections, as
+        # the client polling loop handles the echo responses itself.
+        data = uuid.uuid4().hex.encode('utf8')
+        answered = threading.Event()
+        self.echoes[data] = answered
+        try:
+            self.sendPacket(gear.Packet(gear.constants.REQ,
+                                        gear.constants.ECHO_REQ, data), conn)
+            return answered.wait(timeout)
+        except Exception:
+            return False
+        finally:
+            self.echoes.pop(data, None)
+
+    def handleEchoRes(self, packet):
+        answered = self.echoes.get(packet.data)
+        if answered is not None:
+            answered.set()
+
+    def submitJobs(self, jobs, background=True, timeout=None):
+        """Submit several jobs at once.
+
+        Every job is sent before waiting for any answer, so submitting
+        takes a single round trip to the server.
+
+        Args:
+            jobs (list): gear.Job instances to submit.
+            background (bool): Whether the jobs are background jobs.
+            timeout (int): Seconds to wait for the server to acknowledge the
+                jobs. Defaults to settings.GEARMAN_TIMEOUT.
+
+        Raises:
+            gear.GearmanError: When a job was not acknowledged.
+        """
+        if timeout is None:
+            timeout = settings.GEARMAN_TIMEOUT
+        command = gear.constants.SUBMIT_JOB_BG if background \
+            else gear.constants.SUBMIT_JOB
+
+        tasks = []
+        with self.submitLock:
+            conn = self._checkedConnection()
+            for job in jobs:
+                data = b'\x00'.join((job.name, job.unique or b'',
+                                     job.arguments))
+                task = gear.SubmitJobTask(job)
+                conn.pending_tasks.append(task)
+                tasks.append(task)
+                self.sendPacket(gear.Packet(gear.constants.REQ, command,
+                                            data), conn)
+
+        deadline = time.time() + timeout
+        for task in tasks:
+            if not task.wait(max(deadline - time.time(), 0)):
+                self._lostConnection(conn)
+                raise gear.GearmanError('Timed out submitting job %s'
+                                        % task.job.name)
+            if not task.job.handle:
+                raise gear.GearmanError('Gearman refused job %s'
+                                        % task.job.name)
+            task.job.connection = conn
+        self.lastChecked[conn] = time.time()
+
+    def adminRequest(self, request, timeout=None):
+        """Send an administrative request and wait for its response.
+
+        Args:
+            request (gear.AdminRequest): Request to send.
+            timeout (int): Seconds to wait for the response. Defaults to
+                settings.GEARMAN_TIMEOUT.
+
+        Raises:
+            gear.TimeoutError: When the server did not answer in time.
+        """
+        if timeout is None:
+            timeout = settings.GEARMAN_TIMEOUT
+
+        with self.submitLock:
+            conn = self._checkedConnection()
+            conn.admin_requests.append(request)
+            try:
+                conn.sendRaw(request.getCommand())
+            except Exception:
+                self._lostConnection(conn)
+                raise
+
+        if not request.waitForResponse(timeout):
+            self._lostConnection(conn)
+            raise gear.TimeoutError()
+        self.lastChecked[conn] = time.time()
+        return request.response
+
+    def _notifyJob(self, job, event, data=None):
+        for listener in self.jobListeners:
+            try:
+                listener(job, event, data)
+            except Exception:
+                self.log.exception('Job listener failed on %s', event)
+        return job
+
+    def handleWorkData(self, packet):
+        job = super(GearClient, self).handleWorkData(packet)
+        return self._notifyJob(job, 'data', packet.getArgument(1, True))
+
+    def handleWorkStatus(self, packet):
+        job = super(GearClient, self).handleWorkStatus(packet)
+        return self._notifyJob(job, 'status', job.fraction_complete)
+
+    def handleWorkComplete(self, packet):
+        job = super(GearClient, self).handleWorkComplete(packet)
+        return self._notifyJob(job, 'complete', packet.getArgument(1, True))
+
+    def handleWorkFail(self, packet):
+        job = super(GearClient, self).handleWorkFail(packet)
+        return self._notifyJob(job, 'fail')
+
+    def handleWorkException(self, packet):
+        job = super(GearClient, self).handleWorkException(packet)
+        return self._notifyJob(job, 'exception', job.exception)
+
+    def handleDisconnect(self, job):
+        job = super(GearClient, self).handleDisconnect(job)
+        return self._notifyJob(job, 'disconnect')
+
+    def submitJob(self, job, background=False,
+                  precedence=gear.PRECEDENCE_NORMAL, timeout=30):
+        if precedence != gear.PRECEDENCE_NORMAL:
+            with self.submitLock:
+                return super(GearClient, self).submitJob(
+                    job, background, precedence, timeout)
+        self.submitJobs([job], background, timeout)
+
+
+def getGearClient():
+    """Return the Gearman client shared by the process."""
+    global _gearClient
+    with _gearClientLock:
+        if _gearClient is None:
+            _gearClient = GearClient()
+    return _gearClient
+
+
+def acquireStreamSlot():
+    """Take one of the CONSOLE_STREAM_SLOTS shared by every process.
+
+    Slots are lock files held with flock, so the slot of a process killed
+    mid-stream is released along with it.
+
+    Returns:
+        file: The locked slot, to close when the stream ends, or None when
+            every slot is taken.
+    """
+    directory = settings.CONSOLE_STREAM_SLOTS_DIR
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    for i in xrange(settings.CONSOLE_STREAM_SLOTS):
+        slot = open(os.path.join(directory, '%d.lock' % i), 'a')
+        try:
+            fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return slot
+        except IOError:
+            slot.close()
+    return None
 
 
 def gearJobFactory(action, projName, label=None, params=None):
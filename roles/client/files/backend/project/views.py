@@ -16,43 +16,21 @@ from django import forms
 from django.contrib.auth.decorators import login_required
 from django.core import urlresolvers
 from django.shortcuts import render, redirect
-from django.http import Http404, HttpResponse
-from jenkins_jobs.builder import Builder as JenkinsJobBuilder
-from tempfile import TemporaryFile
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+    StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 import gear
+import jenkins
 import simplejson
+import time
 import uuid
-import yaml
 
 from client import settings
 from projectdata.settings import DataManager
-from synccontrol import SyncControl
-import account.utils
 import partner.utils
 import models
-
-
-def _updateJenkinsJob(jobDescription):
-    nodes = partner.utils.getOnlineNodes()
-
-    tempFile = TemporaryFile()
-    tempFile.write(yaml.dump(jobDescription))
-
-    for node in nodes:
-        tempFile.seek(0)
-        jenkinsUrl = 'http://%(ip)s:%(port)s/' \
-                     % {'ip': node.host, 'port': node.port}
-        jUser, jPassword, hash = partner.utils.getJenkinsUser(node.site)
-        builder = JenkinsJobBuilder(jenkinsUrl,
-                                    jUser,
-                                    jPassword,
-                                    ignore_cache=True)
-        builder.update_jobs(tempFile)
-        account.utils.changePassword(settings.LDAP_USER_DN_TEMPLATE % jUser,
-                                     hash,
-                                     account.utils.hashPassword(
-                                         account.utils.randomPassword()))
-    tempFile.close()
+import utils
 
 
 @login_required
@@ -85,7 +63,9 @@ def create(request, projType):
             d = data(project, request.POST)
             thisDataList.append(d)
 
-        _updateJenkinsJob(project.getData())
+        # Jobs are published to the nodes by the syncworker command.
+        models.Project.updateDefinitions([project])
+        models.SyncRequest.enqueue(project)
 
         return render(request,
                       'project/create_successful.html',
@@ -110,12 +90,78 @@ def list(request):
         tabs.remove('')
     except ValueError:
         pass
-    context = {'projects': request.user.project_set.all(),
+    projects = request.user.project_set.all()
+    # Iterating evaluates the queryset, the template then reuses its cache.
+    for project in projects:
+        if project.name.lower() in tabs:
+            project.buildPage, project.buildCursor = \
+                models.Build.timeline(project)
+    context = {'projects': projects,
                'tabs': tabs,
-               'active': active}
+               'active': active,
+               'statusPollInterval': settings.STATUS_POLL_INTERVAL * 1000}
     return render(request, 'project/list.html', context)
 
 
+@login_required
+def status(request):
+    """Respond the last build status of every project of the user.
+
+    Statuses come from the recorded builds in a single query, so the
+    projects list may be rendered at once and filled in afterwards. The
+    response ETag is the builds status version (see Build.statusVersion),
+    which is checked first, so clients whose statuses did not change are
+    answered 304 without computing them.
+
+    Returns:
+        HttpResponse: A JSON object mapping project names to their last
+            build number, node, result, whether it is still building and
+            timestamp, or to null when not built yet.
+    """
+    projects = request.user.project_set.all()
+    etag = models.Build.statusVersion(projects)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(
+            simplejson.dumps(models.Build.statuses(projects)),
+            content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    return response
+
+
+@login_required
+def statusEvents(request):
+    """Stand in for the status events stream, served by statusevents.
+
+    Streams are served out of the uwsgi workers by the statusevents
+    command, which nginx routes this URL to (see statusevents.py). Reaching
+    this view means it does not, and 204 tells browsers to stop trying, so
+    the page polls the status view instead.
+    """
+    return HttpResponse(status=204)
+
+
+@login_required
+def publishStatus(request, projName):
+    """Respond the publish state of a project job on each partner node.
+
+    Returns:
+        HttpResponse: A JSON object with the list of nodes states, see
+            JobDeployment.publishStatus, and whether any is still pending.
+    """
+    try:
+        project = models.Project.objects.get(name=projName,
+                                             owner=request.user)
+    except models.Project.DoesNotExist:
+        raise Http404("No project found with name %s." % projName)
+
+    nodes = models.JobDeployment.publishStatus(project)
+    pending = any(node['state'] == 'pending' for node in nodes)
+    return HttpResponse(simplejson.dumps({'nodes': nodes,
+                                          'pending': pending}),
+                        content_type='application/json')
+
+
 @login_required
 def update(request):
     return Http404()
@@ -132,19 +178,188 @@ def _compairBuildsTimestamp(x, y):
 
 @login_required
 def delete(request, projName):
-    nodes = partner.utils.getOnlineNodes()
+    try:
+        project = models.Project.objects.get(name=projName,
+                                             owner=request.user)
+    except models.Project.DoesNotExist:
+        raise Http404("No project found with name %s." % projName)
+
+    # The project job is removed from the nodes by the syncworker command.
+    models.JobTombstone.bury(project)
+    return redirect(urlresolvers.reverse('project:list'))
 
-    for node in nodes:
-        jConn = node.connect()
 
-        if jConn.job_exists(projName):
-            jConn.delete_job(projName)
+@login_required
+def buildHistory(request, projName):
+    """Respond a page of a project build history, newest first.
 
-        node.disconnect()
+    The page starts after the 'cursor' GET parameter. The X-Next-Cursor
+    header carries the cursor of the next page, if there is one.
+    """
+    try:
+        project = models.Project.objects.get(name=projName,
+                                             owner=request.user)
+    except models.Project.DoesNotExist:
+        raise Http404("No project found with name %s." % projName)
 
-    project = models.Project.objects.get(name=projName)
-    project.delete()
-    return redirect(urlresolvers.reverse('project:list'))
+    try:
+        builds, cursor = models.Build.timeline(project,
+                                               request.GET.get('cursor'))
+    except ValueError:
+        raise Http404("Invalid build history cursor.")
+
+    response = render(request, 'project/build_list.html',
+                      {'project': project, 'builds': builds})
+    if cursor is not None:
+        response['X-Next-Cursor'] = cursor
+    return response
+
+
+def _getBuild(request, projName, nodeId, number):
+    try:
+        return models.Build.objects.select_related('node', 'project').get(
+            project__name=projName, project__owner=request.user,
+            node_id=nodeId, number=number)
+    except models.Build.DoesNotExist:
+        raise Http404("No build %s of %s found." % (number, projName))
+
+
+def _clampedParam(request, name, default, minimum, maximum=None):
+    """Return the integer GET parameter name, clamped to its bounds.
+
+    Raises:
+        ValueError: When the parameter is not an integer.
+    """
+    value = max(int(request.GET.get(name, default)), minimum)
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
+
+@login_required
+def consoleOutput(request, projName, nodeId, number):
+    """Respond a byte range of a build console output.
+
+    The range starts at the 'start' GET parameter and spans at most 'limit'
+    bytes. As in the Jenkins progressiveText API, the X-Text-Size header
+    carries the offset to continue reading from and X-More-Data is set
+    while there is more text to read.
+
+    Archived console outputs may also be read by lines using the 'line'
+    and 'lines' GET parameters instead.
+    """
+    build = _getBuild(request, projName, nodeId, number)
+
+    if 'line' in request.GET:
+        return _consoleOutputLines(request, build)
+
+    try:
+        start = _clampedParam(request, 'start', 0, 0)
+        limit = _clampedParam(request, 'limit',
+                              settings.CONSOLE_OUTPUT_PAGE_SIZE, 1,
+                              settings.CONSOLE_OUTPUT_PAGE_SIZE)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid console output range.")
+
+    try:
+        text, nextStart, moreData = build.consoleOutput(start, limit)
+    except jenkins.NotFoundException:
+        raise Http404("Console output of build %s was discarded by its node."
+                      % build.number)
+    except (jenkins.JenkinsException, IOError):
+        # IOError covers the URLError and socket errors of offline nodes.
+        return HttpResponse("Node of build %s is unreachable." % build.number,
+                            status=503)
+
+    response = HttpResponse(text, content_type='text/plain; charset=utf-8')
+    response['X-Text-Size'] = nextStart
+    if moreData:
+        response['X-More-Data'] = 'true'
+    return response
+
+
+def _consoleOutputLines(request, build):
+    """Respond 'lines' lines of an archived console output from 'line' on.
+
+    The X-Line-Count header carries the amount of lines of the whole log.
+    """
+    try:
+        start = _clampedParam(request, 'line', 0, 0)
+        count = _clampedParam(request, 'lines',
+                              settings.CONSOLE_OUTPUT_PAGE_LINES, 1,
+                              settings.CONSOLE_OUTPUT_PAGE_LINES)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid console output lines.")
+
+    lines = build.consoleLines(start, count)
+    if lines is None:
+        raise Http404("Console output of build %s is not archived."
+                      % build.number)
+    lines, lineCount = lines
+
+    response = HttpResponse('\n'.join(lines),
+                            content_type='text/plain; charset=utf-8')
+    response['X-Line-Count'] = lineCount
+    return response
+
+
+def _tailConsoleOutput(build, start, slot):
+    """Yield the console output of a running build as it is written.
+
+    Tailing stops when the build finishes or after CONSOLE_STREAM_DURATION
+    seconds, so the request ends before the WSGI worker is recycled. Reads
+    from the node never wait past that deadline.
+    """
+    deadline = time.time() + settings.CONSOLE_STREAM_DURATION
+    try:
+        jconn = build.node.connect()
+        while True:
+            jconn.timeout = min(settings.NODE_TIMEOUT,
+                                max(deadline - time.time(), 1))
+            text, start, moreData = partner.utils.getConsoleText(
+                jconn, build.project.name, build.number, start,
+                settings.CONSOLE_OUTPUT_PAGE_SIZE)
+            if text:
+                yield text
+            remaining = deadline - time.time()
+            if not moreData or remaining <= 0:
+                break
+            # Wait for new output only once caught up with the build.
+            if len(text) < settings.CONSOLE_OUTPUT_PAGE_SIZE:
+                time.sleep(min(settings.CONSOLE_STREAM_INTERVAL, remaining))
+    finally:
+        build.node.disconnect()
+        slot.close()
+
+
+@login_required
+def streamConsoleOutput(request, projName, nodeId, number):
+    """Stream the console output of a running build from 'start' on.
+
+    Only new bytes are forwarded, using the offsets of the Jenkins
+    progressiveText API. Clients resume from the amount of bytes received
+    when the stream ends before the build does.
+
+    Only CONSOLE_STREAM_SLOTS streams run at once. Beyond that, 503 is
+    answered and clients read the console output by pages meanwhile.
+    """
+    build = _getBuild(request, projName, nodeId, number)
+    try:
+        start = _clampedParam(request, 'start', 0, 0)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid console output offset.")
+
+    slot = utils.acquireStreamSlot()
+    if slot is None:
+        response = HttpResponse("Too many console streams.", status=503)
+        response['Retry-After'] = settings.CONSOLE_STREAM_INTERVAL
+        return response
+
+    response = StreamingHttpResponse(_tailConsoleOutput(build, start, slot),
+                                     content_type='text/plain; charset=utf-8')
+    # Keep nginx from buffering the stream.
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @login_required
@@ -153,23 +368,18 @@ def buildProject(request, projName):
     assert proj is not None, "No project found with name %s." % projName
     proj.triggerBuild()
 
-    SyncControl.sync(proj)
+    models.SyncRequest.enqueue(proj)
 
     return HttpResponse('ok')
 
 
 # Does not working
 def abortBuild(request, projName):
-    gclient = gear.Client()
-    gclient.addServer(settings.GEARMAN_HOST)
-    gclient.waitForServer()
-
     jobId = uuid.uuid4().hex
     job = gear.Job('stop:' + settings.GEARMAN_HOST,
                    simplejson.dumps({'OFFLINE_NODE_WHEN_COMPLETE': 'false',
                                      'name': projName}),
                    unique=jobId)
-    gclient.submitJob(job, True)
-    gclient.shutdown()
+    utils.getGearClient().submitJob(job, True)
 
     return HttpResponse('ok')
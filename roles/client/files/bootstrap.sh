@@ -16,6 +16,20 @@
 
 python /home/client/backend/manage.py makemigrations
 python /home/client/backend/manage.py migrate
+python /home/client/backend/manage.py pollbuilds \
+    >> /var/log/client/pollbuilds.log 2>&1 &
+python /home/client/backend/manage.py syncworker \
+    >> /var/log/client/syncworker.log 2>&1 &
+python /home/client/backend/manage.py trackbuilds \
+    >> /var/log/client/trackbuilds.log 2>&1 &
+python /home/client/backend/manage.py statusevents \
+    >> /var/log/client/statusevents.log 2>&1 &
+python /home/client/backend/manage.py syncfirewall \
+    >> /var/log/client/syncfirewall.log 2>&1 &
+python /home/client/backend/manage.py probenodes \
+    >> /var/log/client/probenodes.log 2>&1 &
+python /home/client/backend/manage.py rotateleases \
+    >> /var/log/client/rotateleases.log 2>&1 &
 uwsgi --chdir /home/client/backend \
       --module client.wsgi:application \
       --env DJANGO_SETTINGS_MODULE=client.settings \